@@ -1,8 +1,13 @@
+import sys
 from ultralytics import YOLO
 
 
 if __name__ == '__main__':
-    model = YOLO("./runs/detect/train/weights/best.pt")
+    # usage: python convert.py [weights] [format ...], e.g. python convert.py best.pt onnx openvino
+    weights = sys.argv[1] if len(sys.argv) > 1 else "./runs/detect/train/weights/best.pt"
+    formats = sys.argv[2:] or ["tfjs"]
+    model = YOLO(weights)
 
     # Export the model
-    model.export(format="tfjs")
\ No newline at end of file
+    for export_format in formats:
+        model.export(format=export_format, dynamic=export_format in ("onnx", "openvino"))
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import cv2
+import numpy as np
+import yaml
+
+# backend -> (suffix of the exported weights next to best.pt, ultralytics export format)
+BACKENDS = {
+    "pytorch": (".pt", None),
+    "onnx": (".onnx", "onnx"),
+    "openvino": ("_openvino_model", "openvino"),
+    "onnx-int8": ("_int8.onnx", None),  # written by quantize.py, needs calibration images
+}
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "minimap.yaml")) as f:
+    CLASS_NAMES = yaml.safe_load(f)["names"]
+
+def exported_path(weights_path, backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', choose one of {', '.join(BACKENDS)}")
+    if backend == "pytorch":
+        return weights_path
+    return os.path.splitext(weights_path)[0] + BACKENDS[backend][0]
+
+def export_model(weights_path, backend, imgsz=640):
+    # dynamic shapes, so the exported model accepts batches of minimap crops
+    from ultralytics import YOLO  # imported on use, clients of inference_service.py never load torch
+    export_format = BACKENDS[backend][1]
+    return YOLO(weights_path).export(format=export_format, imgsz=imgsz, dynamic=True)
+
+def load_model(weights_path, backend="pytorch"):
+    path = exported_path(weights_path, backend)
+    if not os.path.exists(path):
+        if BACKENDS[backend][1] is None:
+            raise FileNotFoundError(f"[ERROR] No {backend} model at {path}, create it with: python quantize.py {weights_path}")
+        print(f"[INFO] No {backend} model found at {path}, exporting {weights_path}")
+        path = export_model(weights_path, backend)
+    from ultralytics import YOLO
+    return YOLO(path, task="detect")
+
+def restrict_classes(model, class_ids):
+    """Zero the scores of all other classes in the detection head, before confidence filtering and NMS.
+
+    Every box then gets the best of the allowed classes. Only possible for PyTorch weights, returns False otherwise.
+    """
+    head = model.model.model[-1] if hasattr(model.model, "model") else None
+    if head is None or getattr(head, "end2end", False):
+        return False
+    blocked = [i for i in range(len(model.names)) if i not in set(class_ids)]
+
+    def mask_scores(module, inputs, output):
+        scores = output[0] if isinstance(output, tuple) else output  # (batch, 4 + classes, anchors)
+        scores[:, [4 + i for i in blocked]] = 0
+        return output
+
+    def add_hook(predictor):
+        # the predictor runs its own copy of the network, so the hook goes on that copy once it exists
+        predictor_head = predictor.model.model.model[-1]
+        if not hasattr(predictor_head, "class_mask"):
+            predictor_head.class_mask = predictor_head.register_forward_hook(mask_scores)
+
+    model.add_callback("on_predict_batch_start", add_hook)
+    return True
+
+def results_to_predictions(result, confidence_threshold=0.0):
+    # [x1, y1, x2, y2, name, prob] per box, the format of results.json, identical for every backend
+    boxes = result.boxes
+    confidences = boxes.conf.cpu().numpy().astype(np.float64)
+    keep = confidences >= confidence_threshold
+    coords = np.rint(boxes.xyxy.cpu().numpy()[keep]).astype(int).tolist()
+    class_ids = boxes.cls.cpu().numpy()[keep].astype(int).tolist()
+    output = []
+    for (x1, y1, x2, y2), class_id, confidence in zip(coords, class_ids, confidences[keep].tolist()):
+        output.append([x1, y1, x2, y2, result.names[class_id], round(confidence, 2)])
+    return output
+
+def predict(model, images, confidence_threshold=0.0, imgsz=None):
+    # imgsz None keeps the size the model was trained/exported with
+    options = {"imgsz": imgsz} if imgsz else {}
+    results = model.predict(images, verbose=False, **options)
+    return [results_to_predictions(result, confidence_threshold) for result in results]
+
+def box_iou(a, b):
+    inter_w = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    inter_h = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = inter_w * inter_h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def compare_predictions(reference, candidate, confidence_threshold, box_tolerance, conf_tolerance):
+    """Greedy same-class IoU matching of two prediction lists, returns a list of problems (empty = parity)."""
+    problems = []
+    unmatched = list(candidate)
+    for ref in reference:
+        matches = [c for c in unmatched if c[4] == ref[4]]
+        best = max(matches, key=lambda c: box_iou(ref, c), default=None)
+        if best is None or box_iou(ref, best) == 0:
+            # boxes right at the confidence threshold may fall on either side of it
+            if ref[5] - confidence_threshold > conf_tolerance:
+                problems.append(f"missing {ref}")
+            continue
+        unmatched.remove(best)
+        box_diff = max(abs(r - c) for r, c in zip(ref[:4], best[:4]))
+        if box_diff > box_tolerance or abs(ref[5] - best[5]) > conf_tolerance:
+            problems.append(f"{ref} vs {best}")
+    problems += [f"extra {c}" for c in unmatched if c[5] - confidence_threshold > conf_tolerance]
+    return problems
+
+def parity_check(weights_path, backend, image_dir, confidence_threshold=0.25, box_tolerance=2, conf_tolerance=0.02):
+    images = image_paths(image_dir)
+    reference_model = load_model(weights_path, "pytorch")
+    candidate_model = load_model(weights_path, backend)
+
+    failed = 0
+    for image in images:
+        reference = predict(reference_model, [image], confidence_threshold)[0]
+        candidate = predict(candidate_model, [image], confidence_threshold)[0]
+        problems = compare_predictions(reference, candidate, confidence_threshold, box_tolerance, conf_tolerance)
+        status = "OK" if not problems else "MISMATCH"
+        print(f"[{status}] {image}: {len(reference)} pytorch / {len(candidate)} {backend} boxes")
+        for problem in problems:
+            print(f"    {problem}")
+        failed += bool(problems)
+
+    print(f"[PARITY] {backend}: {len(images) - failed}/{len(images)} images within {box_tolerance}px / {conf_tolerance} confidence")
+    return failed == 0
+
+def match_rate(reference, candidate, iou_threshold=0.5):
+    # share of the reference boxes found again by the candidate (same class, IoU >= iou_threshold)
+    unmatched = list(candidate)
+    matched = 0
+    for ref in reference:
+        best = max((c for c in unmatched if c[4] == ref[4]), key=lambda c: box_iou(ref, c), default=None)
+        if best is not None and box_iou(ref, best) >= iou_threshold:
+            unmatched.remove(best)
+            matched += 1
+    return matched / len(reference) if reference else 1.0
+
+def test_split_yaml(dataset_dir, images=None):
+    """model.val() data file for the split written by generateTestingImages.py (dataset/images/test, dataset/labels/test).
+
+    images optionally limits the split to these image paths, e.g. to keep calibration images out of the evaluation.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    split = "images/test"
+    if images is not None:
+        split = os.path.join(tmp_dir, "test.txt")
+        with open(split, "w") as f:
+            f.write("\n".join(os.path.abspath(image) for image in images))
+    path = os.path.join(tmp_dir, "test_split.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump({"path": os.path.abspath(dataset_dir), "train": split, "val": split, "test": split,
+                        "names": dict(enumerate(CLASS_NAMES))}, f)
+    return path
+
+def image_paths(image_dir):
+    return [os.path.join(image_dir, f) for f in sorted(os.listdir(image_dir)) if f.lower().endswith((".png", ".jpg", ".jpeg"))]
+
+def measure_latency(model, images, confidence_threshold=0.25, imgsz=None, repeats=3):
+    # median and p95 in ms of batch-1 predictions on decoded images, after a warm-up call for the input shape
+    predict(model, images[:1], confidence_threshold, imgsz)
+    durations = []
+    for _ in range(repeats):
+        for image in images:
+            start = time.perf_counter()
+            predict(model, [image], confidence_threshold, imgsz)
+            durations.append(time.perf_counter() - start)
+    return round(float(np.median(durations)) * 1000, 2), round(float(np.percentile(durations, 95)) * 1000, 2)
+
+def imgsz_sweep(weights_path, backend, sizes, image_dir, dataset_dir=None, confidence_threshold=0.25, repeats=3):
+    """Latency per minimap crop (batch 1, CPU) and accuracy per inference size.
+
+    Accuracy is mAP on the generated test split when dataset_dir has one, and always the agreement with the boxes of
+    the largest size on the unlabeled image_dir images.
+    """
+    model = load_model(weights_path, backend)
+    images = [cv2.imread(path) for path in image_paths(image_dir)]  # decoded once, only inference is timed
+    data = None
+    if dataset_dir and os.path.isdir(os.path.join(dataset_dir, "labels", "test")):
+        data = test_split_yaml(dataset_dir)
+    else:
+        print(f"[INFO] No generated test split in {dataset_dir}, reporting agreement with the largest size only")
+
+    rows = []
+    reference = None
+    for size in sorted(sizes, reverse=True):
+        latency_ms, p95_ms = measure_latency(model, images, confidence_threshold, size, repeats)
+        outputs = [predict(model, [image], confidence_threshold, size)[0] for image in images]
+        reference = reference or outputs
+        row = {
+            "imgsz": size,
+            "latency_ms": latency_ms,
+            "p95_ms": p95_ms,
+            "boxes": sum(len(output) for output in outputs),
+            "agreement": round(float(np.mean([match_rate(r, o) for r, o in zip(reference, outputs)])), 4),
+        }
+        if data:
+            metrics = model.val(data=data, split="test", imgsz=size, conf=0.001, device="cpu", plots=False, verbose=False)
+            row.update(map50=round(float(metrics.box.map50), 4), map50_95=round(float(metrics.box.map), 4))
+        rows.append(row)
+        print(f"[SWEEP] imgsz {size}: {row['latency_ms']} ms/crop, agreement {row['agreement']}"
+              + (f", mAP50 {row['map50']}, mAP50-95 {row['map50_95']}" if data else ""))
+    return sorted(rows, key=lambda row: row["imgsz"])
+
+def cheapest_size(rows, tolerance):
+    # smallest size whose accuracy stays within tolerance of the largest size
+    metric = "map50" if "map50" in rows[-1] else "agreement"
+    best = rows[-1][metric]
+    return next(row["imgsz"] for row in rows if row[metric] >= best - tolerance), metric
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the minimap detector to CPU inference backends and check parity")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="export best.pt to ONNX and/or OpenVINO")
+    export_parser.add_argument("weights", help="e.g. models/balanced-approach/weights/best.pt")
+    export_parser.add_argument("--backend", nargs="+", default=["onnx", "openvino"], choices=[b for b in BACKENDS if BACKENDS[b][1]])
+    export_parser.add_argument("--imgsz", type=int, default=640)
+
+    parity_parser = subparsers.add_parser("parity", help="compare an exported backend against the pytorch model")
+    parity_parser.add_argument("weights")
+    parity_parser.add_argument("--backend", default="onnx", choices=[b for b in BACKENDS if b != "pytorch"])
+    parity_parser.add_argument("--images", default="example_test_data")
+    parity_parser.add_argument("--conf", type=float, default=0.25)
+    parity_parser.add_argument("--box-tolerance", type=float, default=2)
+    parity_parser.add_argument("--conf-tolerance", type=float, default=0.02)
+
+    sweep_parser = subparsers.add_parser("sweep", help="latency vs. accuracy of the inference sizes")
+    sweep_parser.add_argument("weights")
+    sweep_parser.add_argument("--backend", default="pytorch", choices=list(BACKENDS))
+    sweep_parser.add_argument("--sizes", type=int, nargs="+", default=[320, 416, 512, 640])
+    sweep_parser.add_argument("--images", default="example_test_data")
+    sweep_parser.add_argument("--dataset", default="dataset", help="folder with the generateTestingImages.py test split")
+    sweep_parser.add_argument("--conf", type=float, default=0.25)
+    sweep_parser.add_argument("--tolerance", type=float, default=0.01, help="accepted accuracy loss against the largest size")
+    sweep_parser.add_argument("--output", help="save the rows as JSON")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        for backend in args.backend:
+            print(f"[DONE] {backend}: {export_model(args.weights, backend, args.imgsz)}")
+    elif args.command == "sweep":
+        rows = imgsz_sweep(args.weights, args.backend, args.sizes, args.images, args.dataset, args.conf)
+        size, metric = cheapest_size(rows, args.tolerance)
+        print(f"[SWEEP] cheapest size within {args.tolerance} {metric} of imgsz {rows[-1]['imgsz']}: {size}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(rows, f, indent=2)
+            print(f"[DONE] Saved {args.output}")
+    else:
+        ok = parity_check(args.weights, args.backend, args.images, args.conf, args.box_tolerance, args.conf_tolerance)
+        raise SystemExit(0 if ok else 1)
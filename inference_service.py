@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+import queue
+import socket
+import secrets
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from multiprocessing.connection import Listener, Client, AuthenticationError
+from PIL import Image
+from inference_backends import load_model, restrict_classes, predict
+
+# Long-lived inference worker: keeps warmed-up detectors in memory and answers batches of minimap crops (or runs whole
+# predict_video.py jobs against itself) over a local socket, so a match does not pay for importing torch and loading
+# best.pt again. Messages are pickled dicts over multiprocessing.connection, authenticated with a key file only the
+# current user can read.
+
+if hasattr(socket, "AF_UNIX"):
+    DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), "minimap_inference.sock")
+else:
+    DEFAULT_ADDRESS = "127.0.0.1:6009"  # no unix sockets on Windows
+ADDRESS_ENV = "INFERENCE_SERVICE"  # set for the predict_video.py jobs started by the service itself
+PROTOCOL_VERSION = 1
+
+class ServiceUnavailable(ConnectionError):
+    pass
+
+def service_address(address=None):
+    return address or os.environ.get(ADDRESS_ENV) or DEFAULT_ADDRESS
+
+def parse_address(address):
+    # "host:port" for TCP, anything else is a unix socket path
+    host, _, port = address.rpartition(":")
+    if port.isdigit() and host and os.sep not in address:
+        return (host, int(port))
+    return address
+
+def key_path(address):
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple):
+        return os.path.join(tempfile.gettempdir(), f"minimap_inference_{parsed[1]}.key")
+    return parsed + ".key"
+
+def model_key(spec):
+    # a changed best.pt (new mtime) gets a new model, blocked classes come from roster_head
+    weights = os.path.abspath(spec["weights"])
+    return (weights, os.path.getmtime(weights), spec.get("backend", "pytorch"), tuple(sorted(spec.get("blocked_classes") or [])))
+
+def load_spec_model(spec):
+    detector = load_model(spec["weights"], spec.get("backend", "pytorch"))
+    blocked = set(spec.get("blocked_classes") or [])
+    if blocked:
+        restrict_classes(detector, [i for i, name in detector.names.items() if name not in blocked])
+    detector.predict([Image.new("RGB", (320, 320))], verbose=False)  # warm-up, the first call builds the predictor
+    return detector
+
+class InferenceServer:
+    def __init__(self, address, replicas=1, max_models=4, jobs=1):
+        self.address = address
+        self.replicas = replicas  # model instances per spec, requests on different connections run in parallel on them
+        self.max_models = max_models
+        self.models = OrderedDict()  # model_key -> queue of idle instances, least recently used first
+        self.lock = threading.Lock()
+        self.job_slots = threading.Semaphore(jobs)
+        self.authkey = secrets.token_bytes(32)
+        self.stopping = False
+
+    def model_pool(self, spec):
+        key = model_key(spec)
+        with self.lock:
+            if key not in self.models:
+                start = time.perf_counter()
+                pool = queue.Queue()
+                for _ in range(self.replicas):
+                    pool.put(load_spec_model(spec))
+                self.models[key] = pool
+                print(f"[INFO] Loaded {key[2]} model {key[0]} x{self.replicas} in {time.perf_counter() - start:.1f}s")
+                while len(self.models) > self.max_models:
+                    evicted, _ = self.models.popitem(last=False)
+                    print(f"[INFO] Unloaded {evicted[2]} model {evicted[0]}")
+            self.models.move_to_end(key)
+            return self.models[key]
+
+    def predict(self, message):
+        pool = self.model_pool(message["model"])
+        detector = pool.get()
+        try:
+            return {"predictions": predict(detector, message["images"], message.get("conf", 0.0), message.get("imgsz"))}
+        finally:
+            pool.put(detector)
+
+    def run_video(self, message):
+        # the job is an ordinary predict_video.py run whose inference comes back to this service
+        with self.job_slots:
+            print(f"[INFO] Video job {message['config']}")
+            env = dict(os.environ, **{ADDRESS_ENV: self.address})
+            result = subprocess.run([sys.executable, "predict_video.py", message["config"]], cwd=message["cwd"], env=env,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        return {"returncode": result.returncode, "output": result.stdout}
+
+    def status(self, message):
+        with self.lock:
+            models = [{"weights": key[0], "backend": key[2], "blocked_classes": len(key[3]), "idle": pool.qsize()}
+                      for key, pool in self.models.items()]
+        return {"version": PROTOCOL_VERSION, "pid": os.getpid(), "models": models}
+
+    def handle(self, connection):
+        handlers = {"predict": self.predict, "video": self.run_video, "status": self.status}
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+                if message.get("op") == "stop":
+                    connection.send({"ok": True})
+                    self.stopping = True
+                    Client(parse_address(self.address), authkey=self.authkey).close()  # wakes up accept()
+                    return
+                try:
+                    reply = {"ok": True, **handlers[message["op"]](message)}
+                except Exception as e:
+                    reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                connection.send(reply)
+
+    def serve(self, preload=()):
+        if isinstance(parse_address(self.address), str) and os.path.exists(self.address):
+            if connect(self.address) is not None:
+                raise RuntimeError(f"[ERROR] An inference service is already running at {self.address}")
+            os.remove(self.address)  # left over from a killed service
+        path = key_path(self.address)
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(self.authkey)
+        for spec in preload:
+            self.model_pool(spec)
+
+        listener = Listener(parse_address(self.address), authkey=self.authkey)
+        print(f"[INFO] Inference service listening on {self.address}")
+        try:
+            while not self.stopping:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, EOFError, OSError):
+                    continue  # client without the key or gone during the handshake
+                if self.stopping:
+                    connection.close()
+                    break
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+        finally:
+            listener.close()
+            if os.path.exists(path):
+                os.remove(path)
+            print("[DONE] Inference service stopped")
+
+class InferenceClient:
+    def __init__(self, connection, spec=None):
+        self.connection = connection
+        self.spec = spec
+
+    def request(self, message):
+        try:
+            self.connection.send(message)
+            reply = self.connection.recv()
+        except (EOFError, OSError) as e:
+            raise ServiceUnavailable(f"Inference service connection lost: {e}") from e
+        if not reply["ok"]:
+            raise RuntimeError(f"[ERROR] Inference service: {reply['error']}")
+        return reply
+
+    def predict(self, images, confidence_threshold=0.0, imgsz=None):
+        message = {"op": "predict", "model": self.spec, "images": images, "conf": confidence_threshold, "imgsz": imgsz}
+        return self.request(message)["predictions"]
+
+    def close(self):
+        self.connection.close()
+
+def connect(address=None, spec=None):
+    # None when no service is running at the address, callers then run inference in-process
+    address = service_address(address)
+    try:
+        with open(key_path(address), "rb") as f:
+            authkey = f.read()
+        client = InferenceClient(Client(parse_address(address), authkey=authkey), spec)
+        if client.request({"op": "status"})["version"] != PROTOCOL_VERSION:
+            client.close()
+            return None
+        return client
+    except (OSError, EOFError, AuthenticationError, ServiceUnavailable):
+        return None
+
+def parse_model(text):
+    weights, _, backend = text.partition(":")
+    return {"weights": weights, "backend": backend or "pytorch"}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local inference service for predict_video.py")
+    parser.add_argument("--address", default=None, help=f"unix socket path or host:port (default {DEFAULT_ADDRESS})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="start the service in the foreground")
+    serve_parser.add_argument("--preload", nargs="*", default=[], metavar="WEIGHTS[:BACKEND]",
+                              help="models to load and warm up before listening, e.g. run_video_app/data/best.pt:onnx")
+    serve_parser.add_argument("--replicas", type=int, default=1, help="model instances per model, for concurrent clients")
+    serve_parser.add_argument("--max-models", type=int, default=4, help="least recently used models beyond this are unloaded")
+    serve_parser.add_argument("--jobs", type=int, default=1, help="concurrent video jobs")
+
+    video_parser = subparsers.add_parser("video", help="run predict_video.py for a config on the service and wait for it")
+    video_parser.add_argument("config")
+    video_parser.add_argument("--cwd", default=".", help="directory with predict_video.py and data/ (default: current)")
+
+    subparsers.add_parser("status", help="list the loaded models")
+    subparsers.add_parser("stop", help="stop the service")
+    args = parser.parse_args()
+    address = service_address(args.address)
+
+    if args.command == "serve":
+        server = InferenceServer(address, args.replicas, args.max_models, args.jobs)
+        server.serve([parse_model(text) for text in args.preload])
+        sys.exit(0)
+
+    client = connect(address)
+    if client is None:
+        print(f"[ERROR] No inference service running at {address}")
+        sys.exit(1)
+    if args.command == "status":
+        status = client.request({"op": "status"})
+        print(f"[INFO] Inference service pid {status['pid']} at {address}")
+        for model in status["models"]:
+            print(f"    {model['backend']:<9} {model['weights']} ({model['idle']} idle, {model['blocked_classes']} blocked classes)")
+    elif args.command == "video":
+        reply = client.request({"op": "video", "config": os.path.abspath(args.config), "cwd": os.path.abspath(args.cwd)})
+        print(reply["output"], end="")
+        sys.exit(reply["returncode"])
+    elif args.command == "stop":
+        client.request({"op": "stop"})
+        print(f"[DONE] Stopped inference service at {address}")
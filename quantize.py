@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import argparse
+import cv2
+import numpy as np
+import onnx
+from onnxruntime.quantization import (quantize_static, quant_pre_process, CalibrationDataReader, CalibrationMethod,
+                                      QuantFormat, QuantType)
+from inference_backends import (export_model, exported_path, load_model, image_paths, measure_latency, test_split_yaml,
+                                CLASS_NAMES)
+
+# Post-training INT8 quantization of the minimap detector with ONNX Runtime (static, QDQ format), calibrated on images
+# from generateTestingImages.py. Writes best_int8.onnx next to best.pt (backend "onnx-int8" in predict_video.py) and a
+# report with per-class AP and CPU latency against the FP32 model.
+
+CALIBRATION_METHODS = {"minmax": CalibrationMethod.MinMax, "entropy": CalibrationMethod.Entropy,
+                       "percentile": CalibrationMethod.Percentile}
+CHAMPION_CLASSES = set(CLASS_NAMES[:CLASS_NAMES.index("AreaIsWarded")])
+
+class MinimapCalibrationReader(CalibrationDataReader):
+    def __init__(self, paths, input_name, imgsz):
+        from ultralytics.data.augment import LetterBox
+        self.paths = iter(paths)
+        self.input_name = input_name
+        self.letterbox = LetterBox(new_shape=(imgsz, imgsz), auto=False)  # same preprocessing as at inference
+
+    def get_next(self):
+        path = next(self.paths, None)
+        if path is None:
+            return None
+        image = self.letterbox(image=cv2.imread(path))
+        blob = image[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0  # BGR HWC -> RGB NCHW
+        return {self.input_name: np.ascontiguousarray(blob)}
+
+def head_nodes(model, float_head=False):
+    # nodes of the Detect head (the last /model.N/ block): its box decoding (DFL, concat, sigmoid) stays in float,
+    # with float_head its convolutions too
+    indices = [int(m.group(1)) for node in model.graph.node if (m := re.match(r"/model\.(\d+)/", node.name))]
+    prefix = f"/model.{max(indices)}/"
+    return [node.name for node in model.graph.node
+            if node.name.startswith(prefix) and (float_head or node.op_type != "Conv")]
+
+def quantize(weights_path, calibration_paths, imgsz=640, method="minmax", float_head=False):
+    fp32_path = exported_path(weights_path, "onnx")
+    if not os.path.exists(fp32_path):
+        fp32_path = export_model(weights_path, "onnx", imgsz)
+    int8_path = exported_path(weights_path, "onnx-int8")
+    prepared_path = os.path.splitext(int8_path)[0] + "_prepared.onnx"
+    # onnx shape inference and graph optimizations recommended before quantization, the symbolic pass fails on dynamic axes
+    quant_pre_process(fp32_path, prepared_path, skip_symbolic_shape=True)
+
+    fp32 = onnx.load(fp32_path)
+    excluded = head_nodes(fp32, float_head)
+    print(f"[INFO] Calibrating on {len(calibration_paths)} images ({method}), {len(excluded)} head nodes stay float")
+    reader = MinimapCalibrationReader(calibration_paths, fp32.graph.input[0].name, imgsz)
+    quantize_static(prepared_path, int8_path, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=CALIBRATION_METHODS[method], nodes_to_exclude=excluded)
+    os.remove(prepared_path)
+
+    # ultralytics reads stride, class names and imgsz from the export metadata
+    int8 = onnx.load(int8_path)
+    del int8.metadata_props[:]
+    int8.metadata_props.extend(fp32.metadata_props)
+    onnx.save(int8, int8_path)
+    print(f"[DONE] {int8_path} ({os.path.getsize(int8_path) / 2 ** 20:.1f} MB, FP32 {os.path.getsize(fp32_path) / 2 ** 20:.1f} MB)")
+    return int8_path
+
+def evaluate(weights_path, backend, data, imgsz, latency_images):
+    model = load_model(weights_path, backend)
+    metrics = model.val(data=data, split="test", imgsz=imgsz, batch=1, conf=0.001, device="cpu", plots=False, verbose=False)
+    ap50 = {model.names[int(c)]: round(float(metrics.box.ap50[n]), 4) for n, c in enumerate(metrics.box.ap_class_index)}
+    latency_ms, p95_ms = measure_latency(model, latency_images, imgsz=imgsz)
+    return {"map50": round(float(metrics.box.map50), 4), "map50_95": round(float(metrics.box.map), 4),
+            "latency_ms": latency_ms, "p95_ms": p95_ms, "ap50": ap50}
+
+def class_group(name):
+    if name in CHAMPION_CLASSES:
+        return "champions"
+    return "pings_CB" if name.endswith("_CB") else "pings"
+
+def compare(fp32, int8):
+    # per-class AP50 of both models and the mean per class group, the small ping icons lose the most in int8
+    classes = {name: {"fp32": ap, "int8": int8["ap50"].get(name, 0.0), "delta": round(int8["ap50"].get(name, 0.0) - ap, 4)}
+               for name, ap in fp32["ap50"].items()}
+    groups = {}
+    for group in ("champions", "pings", "pings_CB"):
+        rows = [row for name, row in classes.items() if class_group(name) == group]
+        if rows:
+            groups[group] = {"classes": len(rows), "fp32": round(float(np.mean([r["fp32"] for r in rows])), 4),
+                             "int8": round(float(np.mean([r["int8"] for r in rows])), 4)}
+    return classes, groups
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="INT8 post-training quantization of the minimap detector (ONNX Runtime)")
+    parser.add_argument("weights", help="e.g. models/balanced-approach/weights/best.pt")
+    parser.add_argument("--dataset", default="dataset", help="folder with the generateTestingImages.py test split")
+    parser.add_argument("--calibration-images", type=int, default=200,
+                        help="first N test images calibrate, the rest are used for the report")
+    parser.add_argument("--method", default="minmax", choices=list(CALIBRATION_METHODS))
+    parser.add_argument("--float-head", action="store_true", help="keep the whole Detect head in float")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--latency-images", default="example_test_data")
+    parser.add_argument("--no-report", action="store_true")
+    args = parser.parse_args()
+
+    paths = image_paths(os.path.join(args.dataset, "images", "test"))
+    if not paths:
+        raise FileNotFoundError(f"[ERROR] No images in {args.dataset}/images/test, run generateTestingImages.py first")
+    calibration_paths, evaluation_paths = paths[:args.calibration_images], paths[args.calibration_images:]
+    int8_path = quantize(args.weights, calibration_paths, args.imgsz, args.method, args.float_head)
+    if args.no_report:
+        raise SystemExit(0)
+
+    if not evaluation_paths:
+        print("[INFO] All test images were used for calibration, the report is evaluated on the calibration images")
+        evaluation_paths = calibration_paths
+    data = test_split_yaml(args.dataset, evaluation_paths)
+    latency_images = [cv2.imread(path) for path in image_paths(args.latency_images)]
+    fp32 = evaluate(args.weights, "onnx", data, args.imgsz, latency_images)
+    int8 = evaluate(args.weights, "onnx-int8", data, args.imgsz, latency_images)
+    classes, groups = compare(fp32, int8)
+
+    print(f"[REPORT] {len(evaluation_paths)} evaluation images, imgsz {args.imgsz}")
+    for name, model in (("FP32", fp32), ("INT8", int8)):
+        print(f"[REPORT] {name}: mAP50 {model['map50']}, mAP50-95 {model['map50_95']}, "
+              f"{model['latency_ms']} ms/crop (p95 {model['p95_ms']} ms)")
+    for group, row in groups.items():
+        print(f"[REPORT] {group:<10} AP50 {row['fp32']:.3f} -> {row['int8']:.3f} ({row['classes']} classes)")
+    for name, row in sorted(classes.items(), key=lambda entry: entry[1]["delta"]):
+        if class_group(name) != "champions":
+            print(f"[REPORT]   {name:<16} {row['fp32']:.3f} -> {row['int8']:.3f}")
+
+    report_path = os.path.splitext(int8_path)[0] + "_report.json"
+    with open(report_path, "w") as f:
+        json.dump({"weights": args.weights, "imgsz": args.imgsz, "method": args.method, "float_head": args.float_head,
+                   "calibration_images": len(calibration_paths), "evaluation_images": len(evaluation_paths),
+                   "fp32": {k: v for k, v in fp32.items() if k != "ap50"},
+                   "int8": {k: v for k, v in int8.items() if k != "ap50"},
+                   "groups": groups, "classes": classes}, f, indent=2)
+    print(f"[DONE] Saved {report_path}")
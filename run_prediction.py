@@ -1,20 +1,11 @@
-from ultralytics import YOLO
-from PIL import Image
+import sys
+from inference_backends import load_model, predict
 
+# usage: python run_prediction.py [pytorch|onnx|openvino] [imgsz]
+backend = sys.argv[1] if len(sys.argv) > 1 else "pytorch"
+imgsz = int(sys.argv[2]) if len(sys.argv) > 2 else None  # None = 640, the crop is ~300 px
 
-model = YOLO("models/balanced-approach/weights/best.pt")
-buf = Image.open("example_cropped_image.png")
-results = model.predict(buf)
-result = results[0]
-output = []
-for box in result.boxes:
-  x1, y1, x2, y2 = [
-    round(x) for x in box.xyxy[0].tolist()
-  ]
-  class_id = box.cls[0].item()
-  prob = round(box.conf[0].item(), 2)
-  output.append([
-    x1, y1, x2, y2, result.names[class_id], prob
-  ])
+model = load_model("models/balanced-approach/weights/best.pt", backend)
+output = predict(model, ["example_cropped_image.png"], imgsz=imgsz)[0]
 
 [print(f"{name}: ({x1},{y1},{x2},{y2}) - {prob} chance") for x1, y1, x2, y2, name, prob in output]
@@ -0,0 +1,291 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import cv2
+import numpy as np
+import psutil
+from PIL import Image, ImageDraw
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from inference_backends import box_iou
+from video_frames import frame_name
+from results_store import load_results, frame_index_from_name
+
+# Offline benchmark of predict_video.py: renders a deterministic 1080p video with a synthetic minimap (map and champion
+# icons from the generateTestingData.py assets), encodes it with ffmpeg and runs the prediction on it with fixed settings.
+# Reports frames/s, time per stage, peak RSS and how well the detections agree with the known icon layout.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(SCRIPT_DIR, "..")
+MAP_PATH = os.path.join(REPO_DIR, "assets", "lolmap.png")
+CHAMPIONS_DIR = os.path.join(REPO_DIR, "champions")
+CHAMP_MAP_PATH = os.path.join(REPO_DIR, "champMap.json")
+
+MATCH_ID = "benchmark"
+MATCH_DIR = os.path.join(SCRIPT_DIR, "data", f"match_{MATCH_ID}")
+VIDEO_PATH = os.path.join(MATCH_DIR, "video.mp4")
+VIDEO_PARAMS_PATH = os.path.join(MATCH_DIR, "video_params.json")
+LAYOUT_PATH = os.path.join(MATCH_DIR, "layout.json")
+CONFIG_PATH = os.path.join(MATCH_DIR, "benchmark_config.json")
+REPORT_PATH = os.path.join(MATCH_DIR, "benchmark.json")
+MODEL_PATH = os.path.join(SCRIPT_DIR, "data", "best.pt")
+
+WIDTH, HEIGHT = 1920, 1080
+MINIMAP_SIZE = 302  # px, minimap of a 1080p stream
+MINIMAP_X, MINIMAP_Y = WIDTH - MINIMAP_SIZE - 19, HEIGHT - MINIMAP_SIZE - 19
+ICON_SIZE = 26  # px, same icon/map ratio as the 35-44 px icons on the 469 px maps of generateTestingData.py
+SAMPLE_FPS = 2  # predict_video.FPS, the rate the layout is sampled at
+
+# fixed settings, so runs on different machines and commits are comparable; --set overrides single keys
+BENCHMARK_SETTINGS = {
+    "resume": False,
+    "timing": True,
+    "backend": "pytorch",
+    "batch_size": 8,
+    "pipeline": False,
+    "tracking": False,
+    "roster": False,
+    "shards": 1,
+    "locate_match": False,
+    "inference_service": False,
+}
+PREDICT_OUTPUTS = ["results.json", "results.npz", "results.jsonl", "checkpoint.json", "timing.json", "shards", "minimap_position"]
+
+def video_params(args):
+    return {"seed": args.seed, "duration": args.duration, "intro": args.intro, "outro": args.outro, "video_fps": args.video_fps}
+
+def champion_icon(name, color):
+    # champion image with a team colored circle, as in generateTestingData.do_work()
+    img = Image.open(os.path.join(CHAMPIONS_DIR, name, "1.png")).convert("RGBA")
+    size = img.size[0]
+    circle = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    ImageDraw.Draw(circle).ellipse([(0, 0), (size, size)], fill=(255, 255, 255, 0), outline=color, width=8)
+    img.paste(circle, (0, 0), circle)
+    return img.resize((ICON_SIZE, ICON_SIZE))
+
+def build_scene(seed):
+    rng = np.random.default_rng(seed)
+    with open(CHAMP_MAP_PATH) as f:
+        champ_names = sorted(champ["champ_name"] for champ in json.load(f).values())
+    champions = []
+    for n, name in enumerate(rng.choice(champ_names, 10, replace=False)):
+        color = (0, 40, 255, 255) if n < 5 else (255, 0, 40, 255)
+        champions.append({
+            "name": str(name),
+            "icon": champion_icon(str(name), color),
+            # every icon runs on its own Lissajous curve around a random point of the map
+            "center": rng.uniform(0.3, 0.7, 2) * MINIMAP_SIZE,
+            "amplitude": rng.uniform(40, 110, 2),
+            "period": rng.uniform(20, 60, 2),
+            "phase": rng.uniform(0, 2 * np.pi, 2),
+        })
+    minimap = Image.open(MAP_PATH).convert("RGBA").resize((MINIMAP_SIZE, MINIMAP_SIZE))
+    ImageDraw.Draw(minimap).rectangle([(0, 0), (MINIMAP_SIZE - 1, MINIMAP_SIZE - 1)], outline=(160, 150, 120, 255), width=2)
+    # smooth noise as game scene, larger than the frame so the camera can pan over it
+    noise = rng.integers(0, 110, (HEIGHT // 8 + 40, WIDTH // 8 + 40, 3), dtype=np.uint8)
+    background = cv2.resize(noise, (noise.shape[1] * 8, noise.shape[0] * 8), interpolation=cv2.INTER_CUBIC)
+    return champions, minimap, background
+
+def layout_at(champions, seconds):
+    # [x1, y1, x2, y2, name] of every icon in minimap coordinates
+    boxes = []
+    for champion in champions:
+        cx, cy = champion["center"] + champion["amplitude"] * np.sin(2 * np.pi * seconds / champion["period"] + champion["phase"])
+        half = ICON_SIZE // 2
+        x1 = int(np.clip(round(cx), half, MINIMAP_SIZE - half)) - half
+        y1 = int(np.clip(round(cy), half, MINIMAP_SIZE - half)) - half
+        boxes.append([x1, y1, x1 + ICON_SIZE, y1 + ICON_SIZE, champion["name"]])
+    return boxes
+
+def render_frame(scene, seconds, game_seconds=None):
+    # game_seconds None renders a frame without minimap (before and after the game)
+    champions, minimap, background = scene
+    pan = int(seconds * 24) % 320
+    frame = background[abs(pan - 160):abs(pan - 160) + HEIGHT, pan:pan + WIDTH].copy()
+    if game_seconds is not None:
+        current = minimap.copy()
+        for champion, (x1, y1, _, _, _) in zip(champions, layout_at(champions, game_seconds)):
+            current.paste(champion["icon"], (x1, y1), champion["icon"])
+        frame[MINIMAP_Y:MINIMAP_Y + MINIMAP_SIZE, MINIMAP_X:MINIMAP_X + MINIMAP_SIZE] = \
+            cv2.cvtColor(np.array(current.convert("RGB")), cv2.COLOR_RGB2BGR)
+    return frame
+
+def build_video(args):
+    params = video_params(args)
+    if os.path.exists(VIDEO_PATH) and os.path.exists(VIDEO_PARAMS_PATH):
+        with open(VIDEO_PARAMS_PATH) as f:
+            if json.load(f) == params:
+                print(f"[SKIP] {VIDEO_PATH} already rendered with these parameters")
+                return
+
+    scene = build_scene(args.seed)
+    os.makedirs(MATCH_DIR, exist_ok=True)
+    total = args.intro + args.duration + args.outro
+    print(f"[INFO] Rendering {total}s at {args.video_fps} fps to {VIDEO_PATH}...")
+    # single threaded x264 with fixed settings, so the same parameters give the same file
+    cmd = ["ffmpeg", "-v", "error", "-y", "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{WIDTH}x{HEIGHT}",
+           "-r", str(args.video_fps), "-i", "-", "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+           "-g", str(args.video_fps * 2), "-threads", "1", "-pix_fmt", "yuv420p", "-an", VIDEO_PATH]
+    encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    for n in range(total * args.video_fps):
+        seconds = n / args.video_fps
+        in_game = args.intro <= seconds < args.intro + args.duration
+        encoder.stdin.write(render_frame(scene, seconds, seconds - args.intro if in_game else None).tobytes())
+    encoder.stdin.close()
+    if encoder.wait() != 0:
+        raise RuntimeError(f"[ERROR] ffmpeg failed with code {encoder.returncode}")
+
+    # ground truth at the sample times of predict_video, snapped to the rendered frame like ffmpeg's fps filter
+    champions = scene[0]
+    layout = {}
+    for index in range(total * SAMPLE_FPS):
+        seconds = round(index / SAMPLE_FPS * args.video_fps) / args.video_fps
+        if args.intro <= seconds < args.intro + args.duration:
+            layout[frame_name(index)] = layout_at(champions, seconds - args.intro)
+    with open(LAYOUT_PATH, "w") as f:
+        json.dump(layout, f)
+    with open(VIDEO_PARAMS_PATH, "w") as f:
+        json.dump(params, f)
+    print(f"[DONE] {VIDEO_PATH} ({os.path.getsize(VIDEO_PATH) // 1024} KB), layout in {LAYOUT_PATH}")
+
+def run_predict(settings):
+    for output in PREDICT_OUTPUTS:
+        path = os.path.join(MATCH_DIR, output)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    config = {"match_url": f"https://www.leagueofgraphs.com/match/bench/{MATCH_ID}#0", **settings}
+    with open(CONFIG_PATH, "w") as f:
+        json.dump(config, f, indent=2)
+
+    # CPU only, the whole process tree (predict_video, its ffmpeg decoder, shard workers) is polled for the peak RSS
+    env = {**os.environ, "CUDA_VISIBLE_DEVICES": "", "YOLO_OFFLINE": "True"}
+    log_path = os.path.join(MATCH_DIR, "predict.log")
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        process = psutil.Popen([sys.executable, "predict_video.py", CONFIG_PATH], cwd=SCRIPT_DIR, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+        peak_rss = 0
+        while process.poll() is None:
+            try:
+                tree = [process] + process.children(recursive=True)
+                peak_rss = max(peak_rss, sum(p.memory_info().rss for p in tree if p.is_running()))
+            except psutil.NoSuchProcess:
+                pass
+            time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"[ERROR] predict_video.py failed with code {process.returncode}, see {log_path}")
+    with open(os.path.join(MATCH_DIR, "timing.json")) as f:
+        timing = json.load(f)
+    return {"process_wall_s": round(elapsed, 3), "peak_rss_mb": round(peak_rss / 2 ** 20, 1), "timing": timing}
+
+def agreement(iou_threshold=0.5):
+    # greedy same-class IoU matching of the predictions against the rendered icons
+    with open(LAYOUT_PATH) as f:
+        layout = json.load(f)
+    results = load_results(MATCH_DIR)
+    frames = [frame for frame in results if frame != "__meta__"]
+    matched = predicted = ious = 0
+    expected = sum(len(layout.get(frame, [])) for frame in frames)
+    for frame in frames:
+        predictions = results[frame]["predictions"]
+        predicted += len(predictions)
+        unmatched = list(predictions)
+        for box in layout.get(frame, []):
+            candidates = [p for p in unmatched if p[4] == box[4]]
+            best = max(candidates, key=lambda p: box_iou(box, p), default=None)
+            if best is not None and box_iou(box, best) >= iou_threshold:
+                unmatched.remove(best)
+                matched += 1
+                ious += box_iou(box, best)
+    meta = results["__meta__"]
+    in_game = sorted(layout, key=frame_index_from_name)
+    return {
+        "frames": len(frames),
+        "precision": round(matched / predicted, 4) if predicted else None,
+        "recall": round(matched / expected, 4) if expected else None,
+        "mean_iou": round(ious / matched, 4) if matched else None,
+        "start_frame": meta.get("start_frame"),
+        "expected_start_frame": in_game[0] if in_game else None,
+        "end_frame": meta.get("end_frame"),
+        "expected_last_frame": in_game[-1] if in_game else None,
+    }
+
+def check_pipeline(settings):
+    # the concurrent pipeline must not change the results: same results.json as a sequential run
+    outputs = {}
+    for pipeline in (False, True):
+        run_predict({**settings, "pipeline": pipeline, "pipeline_workers": {"preprocess": 2}})
+        with open(os.path.join(MATCH_DIR, "results.json")) as f:
+            outputs[pipeline] = json.load(f)
+    differing = sorted(frame for frame in set(outputs[False]) | set(outputs[True])
+                       if outputs[False].get(frame) != outputs[True].get(frame))
+    print(f"[CHECK] pipeline vs sequential: {len(differing)} of {len(outputs[False])} results.json entries differ"
+          + (f" (first {', '.join(differing[:5])})" if differing else ""))
+    return not differing
+
+def parse_setting(text):
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducible offline benchmark of predict_video.py on a synthetic 1080p video")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duration", type=int, default=120, help="seconds with minimap")
+    parser.add_argument("--intro", type=int, default=10, help="seconds without minimap before the game")
+    parser.add_argument("--outro", type=int, default=10, help="seconds without minimap after the game")
+    parser.add_argument("--video-fps", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=1, help="runs, the report uses the one with the median frames/s")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a predict_video setting, JSON value or plain string, e.g. --set backend=onnx --set tracking=true")
+    parser.add_argument("--output", default=REPORT_PATH)
+    parser.add_argument("--check-pipeline", action="store_true",
+                        help="only check that pipeline and sequential mode write the same results.json, exit 1 if not")
+    args = parser.parse_args()
+
+    if not os.path.exists(MODEL_PATH):
+        raise FileNotFoundError(f"[ERROR] Model not found at: {MODEL_PATH}")
+    settings = {**BENCHMARK_SETTINGS, **dict(parse_setting(s) for s in args.set)}
+    build_video(args)
+    if args.check_pipeline:
+        sys.exit(0 if check_pipeline(settings) else 1)
+
+    runs = []
+    for run in range(args.repeat):
+        print(f"[INFO] Run {run + 1}/{args.repeat} with {json.dumps(settings)}")
+        runs.append(run_predict(settings))
+        print(f"[INFO] {runs[-1]['timing']['frames_per_s']} frames/s, peak RSS {runs[-1]['peak_rss_mb']} MB")
+    runs.sort(key=lambda r: r["timing"]["frames_per_s"] or 0)
+    median = runs[len(runs) // 2]
+
+    report = {
+        "video": video_params(args),
+        "settings": settings,
+        "frames": median["timing"]["frames"],
+        "frames_per_s": median["timing"]["frames_per_s"],
+        "frames_per_s_runs": [r["timing"]["frames_per_s"] for r in runs],
+        "process_wall_s": median["process_wall_s"],
+        "peak_rss_mb": median["peak_rss_mb"],
+        "stages": median["timing"]["stages"],
+        "agreement": agreement(),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"[BENCH] {report['frames']} frames, {report['frames_per_s']} frames/s "
+          f"({report['process_wall_s']}s incl. startup), peak RSS {report['peak_rss_mb']} MB")
+    for name, stage in sorted(report["stages"].items(), key=lambda entry: -entry[1]["total_s"]):
+        print(f"[BENCH] {name:<16} {stage['total_s']:8.2f}s  p50 {stage['p50_ms']:.2f} ms  p95 {stage['p95_ms']:.2f} ms")
+    quality = report["agreement"]
+    print(f"[BENCH] agreement: precision {quality['precision']}, recall {quality['recall']}, mean IoU {quality['mean_iou']}, "
+          f"start {quality['start_frame']} (expected {quality['expected_start_frame']}), "
+          f"end {quality['end_frame']} (last in-game {quality['expected_last_frame']})")
+    print(f"[DONE] Saved {args.output}")
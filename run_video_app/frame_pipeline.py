@@ -0,0 +1,91 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class _Done:
+    def __init__(self, error=None):
+        self.error = error
+
+def _close(items):
+    close = getattr(items, "close", None)
+    if close is not None:
+        close()
+
+def threaded(items, maxsize):
+    """Iterate items in a background thread and yield them through a bounded queue.
+
+    The queue size is the backpressure: the producer blocks as soon as maxsize items are waiting.
+    Exceptions of the producer are raised in the consumer, closing the generator stops the producer.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        error = None
+        try:
+            for item in items:
+                if not put(item):
+                    break
+        except BaseException as e:  # KeyboardInterrupt and SystemExit too, the consumer must not wait forever
+            error = e
+        finally:
+            try:
+                _close(items)
+            except BaseException as e:
+                error = error or e
+            put(_Done(error))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if isinstance(item, _Done):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def ordered_map(func, items, workers, maxsize):
+    """Apply func to items on a pool of worker threads and yield the results in input order.
+
+    At most maxsize items are in flight, so a slow consumer also slows down reading from items.
+    """
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= maxsize:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        _close(items)
+
+def distribute(items, consumers):
+    """Hand every item to each consumer (a callable) before yielding it on, so one decode pass feeds several stages.
+
+    Consumers run in the producer's thread and in item order; they are not closed here.
+    """
+    try:
+        for item in items:
+            for consumer in consumers:
+                consumer(item)
+            yield item
+    finally:
+        _close(items)
@@ -1,50 +1,205 @@
 import os
 import cv2
 import json
-import subprocess
-from ultralytics import YOLO # type: ignore
+import time
+import hashlib
+import numpy as np
 from PIL import Image as PILImage
-import json
 import sys
+import shutil
+import threading
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from inference_backends import load_model, results_to_predictions, restrict_classes
+from inference_service import connect, service_address, ServiceUnavailable
+from video_frames import (stream_frames, extract_frames, read_frame_files, probe_video, frame_name, read_frame,
+                          VideoWriter, join_videos)
+from vod_segments import wait_for_playlist, SEGMENTS_DIR, PLAYLIST_NAME
+from frame_pipeline import threaded, ordered_map, distribute
+from results_store import records_to_columns, save_columns, format_timestamp, frame_index_from_name
+from tracking import MinimapTracker
+from roster import load_roster, constrain_to_roster, CHAMPION_NAMES
+from stage_timing import StageTimer
 
 # ---- CONFIGURATION ---- #
-config_path = sys.argv[1] if len(sys.argv) > 1 else "config.json"
-with open(config_path) as f:
-    config = json.load(f)
-
-match_id = config["match_url"].split("/")[-1].split("#")[0]
-CONFIG_DIR = os.path.join("data", f"match_{match_id}")
-VIDEO_PATH = os.path.join(CONFIG_DIR, "video.mp4")
-TEMPLATE_PATH = os.path.join(CONFIG_DIR, "minimap.png")
-FRAMES_DIR = os.path.join(CONFIG_DIR, "frames")
-MINIMAP_POS_DIR = os.path.join(CONFIG_DIR, "minimap_position")
-
 MODEL_PATH = "data/best.pt"
+PING_MAP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pingMap.json")
 
 # Video extraction settings
 FPS = 2  # reduced frames per second to limit data
 CONFIDENCE_THRESHOLD = 0.65  # minimum confidence to include a prediction
 FRAME_SKIP = 2  # process every Nth frame to reduce output
 MINIMAP_SCORE_THRESHOLD = 80000  # Mindestfläche als Score für gültige Minimap-Erkennung
+MAX_CONSECUTIVE_MISSES = 15  # frames without minimap before the match counts as ended
+MAX_PREDICTION_MISSES = 15  # frames without predictions before the match counts as ended
+MINIMAP_PROBE_FRAMES = 3  # consecutive frames that must agree on the minimap box before decoding only that region
+CROP_MARGIN = 10  # px around the minimap box kept in region decoding, so its border can still be detected
+PRESENCE_SIZE = 32  # px, the minimap is downscaled to PRESENCE_SIZE x PRESENCE_SIZE for the presence check
+CHANGE_SIZE = 64  # px, crops are compared as CHANGE_SIZE x CHANGE_SIZE grayscale
+RESULT_CONSTANTS = ["FPS", "CONFIDENCE_THRESHOLD", "FRAME_SKIP", "MINIMAP_SCORE_THRESHOLD", "MAX_CONSECUTIVE_MISSES",
+                    "MAX_PREDICTION_MISSES", "MINIMAP_PROBE_FRAMES", "CROP_MARGIN", "PRESENCE_SIZE", "CHANGE_SIZE"]
+RUNTIME_SETTINGS = {"resume", "timing", "timing_progress", "inference_service", "pipeline", "pipeline_workers",
+                    "pipeline_queue_size", "pipeline_cpus", "pipeline_memory_mb", "progressive", "segment_timeout",
+                    "segment_seconds", "local_vod_rate"}  # config keys without effect on the results
+
+def configure(path, match_config=None, shard=None):
+    """Set the per-match settings below from a config (read from path unless given), before anything else runs."""
+    global config_path, config, SHARD, CONFIG_DIR, VIDEO_PATH, TEMPLATE_PATH, FRAMES_DIR, MINIMAP_POS_DIR, \
+        RESULTS_LOG_PATH, CHECKPOINT_PATH, CHAMPION_TEAMS_PATH, TIMING_PATH, SHARDS_DIR, SHARD_PLAN_PATH, BACKEND, \
+        INFERENCE_BATCH_SIZE, SAVE_FRAMES, CROP_DECODE, IMGSZ, CROP_DECODE_SIZE, PRESENCE_THRESHOLD, CHANGE_THRESHOLD, \
+        ADAPTIVE_SAMPLING, ADAPTIVE_SPARSE_SKIP, ADAPTIVE_BUDGET, ADAPTIVE_MOVE_PX, RESUME, PIPELINE, PIPELINE_WORKERS, \
+        PIPELINE_QUEUE_SIZE, TRACKING, TRACK_EVERY, TRACK_MIN_SCORE, ROSTER, ROSTER_HEAD, TIMING, TIMING_PROGRESS, \
+        SHARDS, LOCATE_MATCH, LOCATE_STEP, INFERENCE_SERVICE, SERVICE_ADDRESS, ROSTER_NAMES, PROGRESSIVE, \
+        SEGMENTS_PLAYLIST, SEGMENT_TIMEOUT, CHAT_PARTS_DIR, CHAT_VIDEO_PATH, CHAT_INFO_PATH, CHAT_REGION, CHAT_FPS, \
+        CHAT_STEP
+    config_path = path
+    if match_config is None:
+        with open(config_path) as f:
+            match_config = json.load(f)
+    config = match_config
+    SHARD = shard  # set for the worker processes of the sharded mode
+
+    match_id = config["match_url"].split("/")[-1].split("#")[0]
+    CONFIG_DIR = os.path.join("data", f"match_{match_id}")
+    VIDEO_PATH = os.path.join(CONFIG_DIR, "video.mp4")
+    TEMPLATE_PATH = os.path.join(CONFIG_DIR, "minimap.png")
+    FRAMES_DIR = os.path.join(CONFIG_DIR, "frames")
+    MINIMAP_POS_DIR = os.path.join(CONFIG_DIR, "minimap_position")
+    RESULTS_LOG_PATH = os.path.join(CONFIG_DIR, "results.jsonl")
+    CHECKPOINT_PATH = os.path.join(CONFIG_DIR, "checkpoint.json")
+    CHAMPION_TEAMS_PATH = os.path.join(CONFIG_DIR, "webdata", "champion_teams.json")
+    TIMING_PATH = os.path.join(CONFIG_DIR, "timing.json")
+    SHARDS_DIR = os.path.join(CONFIG_DIR, "shards")
+    SHARD_PLAN_PATH = os.path.join(SHARDS_DIR, "plan.json")
+    SEGMENTS_PLAYLIST = os.path.join(CONFIG_DIR, SEGMENTS_DIR, PLAYLIST_NAME)
+    CHAT_PARTS_DIR = os.path.join(CONFIG_DIR, "chat_region_parts")
+    CHAT_VIDEO_PATH = os.path.join(CONFIG_DIR, "chat_text", "chat_region.mp4")
+    CHAT_INFO_PATH = os.path.join(CONFIG_DIR, "chat_text", "chat_region.json")
+    if SHARD is not None:
+        # a shard is an ordinary resumable run on its own log and checkpoint, the merge builds results.json
+        RESULTS_LOG_PATH = os.path.join(SHARDS_DIR, f"shard_{SHARD}", "results.jsonl")
+        CHECKPOINT_PATH = os.path.join(SHARDS_DIR, f"shard_{SHARD}", "checkpoint.json")
+        TIMING_PATH = os.path.join(SHARDS_DIR, f"shard_{SHARD}", "timing.json")
+
+    BACKEND = config.get("backend", "pytorch")  # pytorch, onnx or openvino, exported next to MODEL_PATH on first use
+    INFERENCE_BATCH_SIZE = config.get("batch_size", 8)  # minimap crops per model.predict() call
+    SAVE_FRAMES = config.get("save_frames", False)  # debug only: dump all frames as PNG into frames/ instead of streaming
+    CROP_DECODE = config.get("crop_decode", False)  # once the minimap is located, let ffmpeg decode only the minimap region
+    IMGSZ = config.get("imgsz")  # inference size in px (multiple of 32), None = the model's 640; the minimap crops are only ~300 px
+    CROP_DECODE_SIZE = config.get("crop_decode_size", IMGSZ)  # optional minimap width/height in px that ffmpeg scales the region to, with imgsz the only resize
+    PRESENCE_THRESHOLD = config.get("presence_threshold", 0.6)  # min correlation with the first minimap to count as visible
+    CHANGE_THRESHOLD = config.get("change_threshold", 0)  # mean abs pixel difference (0-255) below which a crop reuses the last predictions, 0 = off
+    ADAPTIVE_SAMPLING = config.get("adaptive_sampling", False)  # infer sparse samples, densify windows with a lot of activity
+    ADAPTIVE_SPARSE_SKIP = config.get("adaptive_sparse_skip", 3)  # infer every Nth sampled frame by default
+    ADAPTIVE_BUDGET = config.get("adaptive_budget", 0.5)  # max share of the sampled frames that goes through inference
+    ADAPTIVE_MOVE_PX = config.get("adaptive_move_px", 30)  # champion move (box center, minimap px) that counts as activity
+    RESUME = config.get("resume", True)  # continue after the last checkpointed frame if a previous run was interrupted
+    PIPELINE = config.get("pipeline", False)  # run decode, preprocessing, inference and writing as concurrent stages
+    PIPELINE_WORKERS = {"decode": 1, "preprocess": 2, "inference": 1, **config.get("pipeline_workers", {})}
+    PIPELINE_QUEUE_SIZE = config.get("pipeline_queue_size", 16)  # max items waiting between two stages
+    TRACKING = config.get("tracking", False)  # full detection only every TRACK_EVERY-th frame, a tracker fills the frames in between
+    TRACK_EVERY = config.get("track_every", 5)  # sampled frames per scheduled detector run
+    TRACK_MIN_SCORE = config.get("track_min_score", 0.6)  # template match score below which the detector runs again right away
+    ROSTER = config.get("roster", False)  # only the 10 champions of champion_teams.json, at most once per frame
+    ROSTER_HEAD = config.get("roster_head", False)  # also zero the other champion classes in the model head (PyTorch weights only)
+    TIMING = config.get("timing", False)  # time every stage, print p50/p95/p99 at the end and save them to timing.json
+    TIMING_PROGRESS = config.get("timing_progress", False)  # with timing: live progress line on stderr
+    SHARDS = config.get("shards", 1)  # split the video into this many time ranges, each predicted by its own process
+    LOCATE_MATCH = config.get("locate_match", False)  # seek to sparse timestamps and binary search the first and last minimap frame first
+    LOCATE_STEP = config.get("locate_step", 20)  # seconds between two coarse probes of the locator
+    INFERENCE_SERVICE = config.get("inference_service", True)  # use a running inference_service.py (true: default address, or its address), false = always in-process
+    SERVICE_ADDRESS = service_address(INFERENCE_SERVICE if isinstance(INFERENCE_SERVICE, str) else None)
+    PROGRESSIVE = config.get("progressive", False)  # without video.mp4, decode the segments of the running download
+    SEGMENT_TIMEOUT = config.get("segment_timeout", 300)  # s to wait for the first or the next segment
+    CHAT_REGION = config.get("chat_region")  # [x, y, w, h] of the chat in video px: the decode also writes it to chat_region.mp4 for the chat OCR, None = off
+    CHAT_FPS = config.get("chat_fps", 1)  # frames/s of chat_region.mp4, at most the sampled FPS / FRAME_SKIP
+    CHAT_STEP = max(round(FPS / FRAME_SKIP / CHAT_FPS), 1)  # sampled frames per chat frame
+    # one way of skipping inference at a time, in this order of precedence (predict_minimaps)
+    skipping = [name for name, enabled in [("tracking", TRACKING), ("adaptive_sampling", ADAPTIVE_SAMPLING),
+                                           ("change_threshold", CHANGE_THRESHOLD > 0)] if enabled]
+    if len(skipping) > 1:
+        print(f"[INFO] {' and '.join(skipping[1:])} ignored, {skipping[0]} takes precedence")
 
-os.makedirs(FRAMES_DIR, exist_ok=True)
-os.makedirs(MINIMAP_POS_DIR, exist_ok=True)
+    if SAVE_FRAMES:
+        os.makedirs(FRAMES_DIR, exist_ok=True)
+    os.makedirs(MINIMAP_POS_DIR, exist_ok=True)
+    timer.reset(TIMING, TIMING_PROGRESS)
+    minimap_reference.clear()
 
-model = YOLO(MODEL_PATH)
+    ROSTER_NAMES = None
+    if ROSTER or ROSTER_HEAD:
+        if os.path.exists(CHAMPION_TEAMS_PATH):
+            ROSTER_NAMES = load_roster(CHAMPION_TEAMS_PATH)
+        else:
+            print(f"[INFO] No {CHAMPION_TEAMS_PATH}, predicting without roster")
 
-def extract_frames(video_path, output_folder, fps=FPS):
-    cmd = [
-        "ffmpeg", "-i", video_path,
-        "-vf", f"fps={fps}",
-        os.path.join(output_folder, "frame_%04d.png")
-    ]
-    subprocess.run(cmd)
+timer = StageTimer()
+with open(PING_MAP_PATH) as f:
+    PING_NAMES = {ping["ping_name"] for ping in json.load(f).values()}
+minimap_reference = {}  # "current": (box, signature) of the saved minimap, shared with the preprocessing workers
+thread_models = threading.local()
+service_connections = []  # every inference service connection of the current run(), closed at its end
+loaded_models = {}  # (weights, mtime, backend) -> model, reused by the next run() in the same process
+service = None
+model = None
+chat = None
+fingerprint = None  # run_fingerprint() of the current run, stored in checkpoint.json and shards/plan.json
 
-def detect_minimap(image):
+def load_roster_model():
+    detector = load_model(MODEL_PATH, BACKEND)
+    if ROSTER_HEAD and ROSTER_NAMES:
+        allowed = [i for i, name in detector.names.items() if name in ROSTER_NAMES or name not in CHAMPION_NAMES]
+        if not restrict_classes(detector, allowed):
+            print(f"[INFO] roster_head needs PyTorch weights, {BACKEND} uses the roster post-processing only")
+    return detector
+
+def connect_service():
+    if not INFERENCE_SERVICE:
+        return None
+    blocked = sorted(CHAMPION_NAMES - ROSTER_NAMES) if ROSTER_HEAD and ROSTER_NAMES else []
+    spec = {"weights": os.path.abspath(MODEL_PATH), "backend": BACKEND, "blocked_classes": blocked}
+    client = connect(SERVICE_ADDRESS, spec)
+    if client is not None:
+        service_connections.append(client)
+    return client
+
+def close_services():
+    # the main and the per-thread connections, otherwise each run() in a batch leaves a handler thread on the server
+    global service, thread_models
+    while service_connections:
+        try:
+            service_connections.pop().close()
+        except OSError:
+            pass
+    service = None
+    thread_models = threading.local()
+
+def shared_model():
+    # a model with roster_head classes removed only fits this match, every other one is kept for the next run()
+    if ROSTER_HEAD and ROSTER_NAMES:
+        return load_roster_model()
+    key = (os.path.abspath(MODEL_PATH), os.path.getmtime(MODEL_PATH), BACKEND)
+    if key not in loaded_models:
+        loaded_models[key] = load_model(MODEL_PATH, BACKEND)
+    return loaded_models[key]
+
+def get_model():
+    # ultralytics predictors are not thread safe, so parallel inference workers each load their own model
+    global model
+    if not PIPELINE or PIPELINE_WORKERS["inference"] <= 1:
+        if model is None:
+            model = load_roster_model()  # the inference service went away
+        return model
+    if not hasattr(thread_models, "model"):
+        thread_models.model = load_roster_model()
+    return thread_models.model
+
+@timer.timed("detect_minimap")
+def detect_minimap(image, roi_fraction=0.35, min_score=MINIMAP_SCORE_THRESHOLD):
     image_height, image_width = image.shape[:2]
 
-    roi_width = int(image_width * 0.35)
-    roi_height = int(image_height * 0.35)
+    roi_width = int(image_width * roi_fraction)
+    roi_height = int(image_height * roi_fraction)
     roi_x = image_width - roi_width
     roi_y = image_height - roi_height
 
@@ -70,113 +225,973 @@ def detect_minimap(image):
                 best_score = score
                 best_box = (x + roi_x, y + roi_y, w, h)
 
-    if best_score < MINIMAP_SCORE_THRESHOLD:
+    if best_score < min_score:
         raise ValueError(f"Minimap score too low ({best_score}), skipping frame")
 
     if best_box is None:
         raise ValueError("Minimap not found via contour detection.")
     return best_box  # returns (x, y, w, h)
 
+def get_service():
+    # connections are not thread safe either, so parallel inference workers each open their own
+    if not PIPELINE or PIPELINE_WORKERS["inference"] <= 1:
+        return service
+    if not hasattr(thread_models, "service"):
+        thread_models.service = connect_service()
+    return thread_models.service
+
+def get_predictions_from_images(images):
+    global service
+    client = get_service() if service else None
+    if client is not None:
+        try:
+            with timer.stage("model_predict", len(images)):
+                return client.predict(images, CONFIDENCE_THRESHOLD, IMGSZ)
+        except ServiceUnavailable:
+            print("[INFO] Inference service is gone, continuing with an in-process model")
+            service = None
+    with timer.stage("model_predict", len(images)):
+        results = get_model().predict(images, **({"imgsz": IMGSZ} if IMGSZ else {}))
+    with timer.stage("postprocess", len(images)):
+        return [results_to_predictions(result, CONFIDENCE_THRESHOLD) for result in results]
+
 def get_predictions_from_image(image):
-    results = model.predict(image)
-    result = results[0]
-    output = []
-    for box in result.boxes:
-        confidence = box.conf[0].item()
-        if confidence < CONFIDENCE_THRESHOLD:
-            continue
-        x1, y1, x2, y2 = [round(x) for x in box.xyxy[0].tolist()]
-        class_id = box.cls[0].item()
-        prob = round(confidence, 2)
-        output.append([x1, y1, x2, y2, result.names[class_id], prob])
-    return output
+    return get_predictions_from_images([image])[0]
 
-def process_frames():
-    results_dict = {}
-    frame_files = sorted([f for f in os.listdir(FRAMES_DIR) if f.endswith(".png")])
-    if not frame_files:
-        print("[ERROR] No frames found.")
-        return
+def batched(items, size, is_counted=lambda item: True):
+    # only items for which is_counted() is true count towards the batch size
+    batch = []
+    count = 0
+    for item in items:
+        batch.append(item)
+        count += is_counted(item)
+        if count >= size:
+            yield batch
+            batch = []
+            count = 0
+    if batch:
+        yield batch
+
+def rescale_predictions(predictions, factor):
+    if factor == 1.0:
+        return predictions
+    return [[round(x1 * factor), round(y1 * factor), round(x2 * factor), round(y2 * factor), name, prob]
+            for x1, y1, x2, y2, name, prob in predictions]
+
+def same_box(box_a, box_b, tolerance=5):
+    return all(abs(a - b) <= tolerance for a, b in zip(box_a, box_b))
+
+def decode_threads():
+    return PIPELINE_WORKERS["decode"] if PIPELINE else None
+
+def get_frames(start_index=0, end_index=None):
+    if SAVE_FRAMES:
+        print("[INFO] Extracting frames...")
+        extract_frames(VIDEO_PATH, FRAMES_DIR, FPS)
+        return read_frame_files(FRAMES_DIR)
+    return timer.iterate("decode", stream_frames(VIDEO_PATH, FPS, FRAME_SKIP, start_index=start_index, end_index=end_index,
+                                                 threads=decode_threads(), segment_timeout=SEGMENT_TIMEOUT))
+
+def sampled_frames(frames, start_index=0):
+    for i, filename, frame in frames:
+        if i % FRAME_SKIP == 0 and i >= start_index:
+            yield i, filename, frame
+
+def chat_fps():
+    return FPS / (FRAME_SKIP * CHAT_STEP)
+
+class ChatRecorder:
+    """Second consumer of the minimap decode: the chat region of every CHAT_STEP-th sampled frame goes into a part of
+    chat_region.mp4, so the chat OCR does not decode the video again. Every run (a shard, a resumed run) writes its
+    own part, named by its first frame index.
+    """
+
+    def __init__(self):
+        self.box = None
+        self.writer = None
+
+    def clip(self, frame_size):
+        height, width = frame_size
+        x, y, w, h = CHAT_REGION
+        left, top = max(x, 0), max(y, 0)
+        return left, top, min(x + w, width) - left, min(y + h, height) - top
+
+    def __call__(self, item, origin=(0, 0)):
+        # origin: position of the decoded (region) frame in the video
+        i, _, frame = item
+        if (i // FRAME_SKIP) % CHAT_STEP:
+            return
+        if self.box is None:
+            self.box = self.clip(frame.shape[:2])
+        x, y, w, h = self.box
+        if self.writer is None:
+            os.makedirs(CHAT_PARTS_DIR, exist_ok=True)
+            self.writer = VideoWriter(os.path.join(CHAT_PARTS_DIR, f"part_{i:06d}.mkv"), chat_fps(), (w, h))
+        with timer.stage("chat_region"):
+            self.writer.write(frame[y - origin[1]:y - origin[1] + h, x - origin[0]:x - origin[0] + w])
 
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+def minimap_signature(minimap):
+    small = cv2.resize(cv2.cvtColor(minimap, cv2.COLOR_BGR2GRAY), (PRESENCE_SIZE, PRESENCE_SIZE),
+                       interpolation=cv2.INTER_AREA).astype(np.float32)
+    small -= small.mean()
+    norm = np.linalg.norm(small)
+    return small / norm if norm > 0 else small
+
+@timer.timed("presence_check")
+def minimap_present(minimap, reference_signature):
+    # normalized correlation of the downscaled crop with the saved minimap, a fraction of a millisecond per frame
+    return float(np.sum(minimap_signature(minimap) * reference_signature)) >= PRESENCE_THRESHOLD
+
+def check_frame(frame_item):
+    # returns (i, filename, frame, box, error, reference): reference is the minimap reference the frame was checked
+    # against, crop_minimaps() checks a frame again if a worker got it before the current reference was published
+    i, filename, frame = frame_item
+    reference = minimap_reference.get("current")
+    if reference is not None:
+        box, signature = reference
+        x, y, w, h = box
+        if minimap_present(frame[y:y+h, x:x+w], signature):
+            return i, filename, frame, box, None, reference
+    # full contour detection only until the minimap is known or when the cheap check fails
+    try:
+        return i, filename, frame, detect_minimap(frame), None, reference
+    except Exception as e:
+        return i, filename, frame, None, e, reference
+
+def save_minimap_position(frame, box, filename):
+    x, y, w, h = box
+    minimap = frame[y:y+h, x:x+w]
+    cv2.imwrite(os.path.join(MINIMAP_POS_DIR, "minimap.png"), minimap)
+    minimap_reference["current"] = (box, minimap_signature(minimap))
+    minimap_reference["frame_size"] = frame.shape[:2]
+    print(f"[INFO] First minimap saved: frame {filename} at x={x}, y={y}, w={w}, h={h}")
+
+def restore_minimap_position(checkpoint):
+    minimap = cv2.imread(os.path.join(MINIMAP_POS_DIR, "minimap.png"))
+    minimap_reference["current"] = (tuple(checkpoint["box"]), minimap_signature(minimap))
+    minimap_reference["frame_size"] = tuple(checkpoint["frame_size"])
+    if checkpoint["last_frame"] is not None:  # None for a shard that has not written anything yet
+        print(f"[INFO] Resuming after frame {checkpoint['last_frame']} with box {tuple(checkpoint['box'])}")
+
+def crop_minimaps(checked_frames, checkpoint=None):
+    # checked_frames: (i, filename, frame, box, error, reference) in frame order, see check_frame()
     minimap_found_once = False
     x = y = w = h = None
-    start_frame = None
-    end_frame = None
     start_frame_index = 0
     miss_counter = 0
-    max_consecutive_misses = 15
-    prediction_miss_counter = 0
-    max_prediction_misses = 15
-    empty_prediction_buffer = []
+    moved = []  # boxes of the consecutive frames that saw the minimap at another position
+    if checkpoint:
+        minimap_found_once = True
+        x, y, w, h = checkpoint["box"]
+        start_frame_index = checkpoint["start_frame_index"]
+        miss_counter = checkpoint["miss_counter"]
 
-    for i, filename in enumerate(frame_files):
-        if i % FRAME_SKIP != 0:
-            continue
+    for i, filename, frame, box, error, reference in checked_frames:
+        if minimap_found_once and reference is not minimap_reference.get("current"):
+            # checked by a pipeline worker against an older reference: same result as in sequential mode
+            i, filename, frame, box, error, reference = check_frame((i, filename, frame))
+        if not minimap_found_once:
+            if error is not None:
+                print(f"[SKIP] Frame {filename}: {error}")
+                continue
+            print(f"[MINIMAP] Detected in frame {filename} with box {box}")
+            x, y, w, h = box
+            save_minimap_position(frame, box, filename)
+            minimap_found_once = True
+            start_frame_index = i
+        elif error is None:
+            miss_counter = 0
+            # a single contour detection jitters by a few px, a move counts once MINIMAP_PROBE_FRAMES frames agree on it
+            if same_box(box, (x, y, w, h)):
+                moved = []
+            else:
+                moved = moved + [box] if moved and same_box(box, moved[0]) else [box]
+                if len(moved) >= MINIMAP_PROBE_FRAMES:
+                    print(f"[MINIMAP] Position changed in frame {filename} to box {box}")
+                    x, y, w, h = box
+                    minimap_reference["current"] = (box, minimap_signature(frame[y:y+h, x:x+w]))
+                    moved = []
+        else:
+            moved = []
+            miss_counter += 1
+            print(f"[MISS] Frame {filename}: Minimap not visible ({miss_counter}/{MAX_CONSECUTIVE_MISSES})")
 
-        frame_path = os.path.join(FRAMES_DIR, filename)
-        frame = cv2.imread(frame_path)
+        yield {
+            "index": i,
+            "filename": filename,
+            "timestamp": (i - start_frame_index) / FPS,
+            # copy so the batch does not keep the full decoded frames alive
+            "minimap": frame[y:y+h, x:x+w].copy(),
+            "box": (x, y, w, h),
+            "miss_counter": miss_counter,
+            "scale": 1.0
+        }
 
-        try:
-            if not minimap_found_once:
-                box = detect_minimap(frame)
-                print(f"[MINIMAP] Detected in frame {filename} with box {box}")
-                x, y, w, h = box
-                minimap_crop = frame[y:y+h, x:x+w]
-                cv2.imwrite(os.path.join(MINIMAP_POS_DIR, "minimap.png"), minimap_crop)
-                print(f"[INFO] First minimap saved: frame {filename} at x={x}, y={y}, w={w}, h={h}")
-                minimap_found_once = True
-                start_frame = filename
-                start_frame_index = i
-            else:
-                try:
-                    _ = detect_minimap(frame)
-                    miss_counter = 0
-                except:
-                    miss_counter += 1
-                    print(f"[MISS] Frame {filename}: Minimap not visible ({miss_counter}/{max_consecutive_misses})")
-
-                box = (x, y, w, h)
-
-            minimap = frame[y:y+h, x:x+w]
-            timestamp = (i - start_frame_index) / FPS
-            predictions = get_predictions_from_image(PILImage.fromarray(cv2.cvtColor(minimap, cv2.COLOR_BGR2RGB)))
-            
-            if not predictions:
-                prediction_miss_counter += 1
-                empty_prediction_buffer.append(filename)
-                print(f"[NO PRED] Frame {filename}: No predictions ({prediction_miss_counter}/{max_prediction_misses})")
-            else:
-                prediction_miss_counter = 0
-                empty_prediction_buffer = []
-            
-            results_dict[filename] = {
-                "timestamp": f"{int(timestamp // 3600):02}:{int((timestamp % 3600) // 60):02}:{int(timestamp % 60):02}",
-                "predictions": predictions
-            }
-            
-            # Matchende wenn beide Bedingungen erfüllt sind
-            if miss_counter >= max_consecutive_misses and prediction_miss_counter >= max_prediction_misses:
-                end_frame = empty_prediction_buffer[0] if empty_prediction_buffer else filename
-                print(f"[END] Match likely ended at frame {end_frame} (via combined condition)")
-                break
+def crop_minimaps_region_decode(checkpoint=None, start_index=0, end_index=None):
+    if checkpoint:
+        yield from decode_minimap_region(tuple(checkpoint["box"]), minimap_reference["frame_size"],
+                                         checkpoint["start_frame_index"], checkpoint["last_index"] + FRAME_SKIP,
+                                         checkpoint["miss_counter"], checkpoint.get("end_index"))
+        return
 
+    # Phase 1: locate the minimap on full frames until MINIMAP_PROBE_FRAMES consecutive frames agree
+    probe_frames = []
+    frames = timer.iterate("decode", stream_frames(VIDEO_PATH, FPS, FRAME_SKIP, start_index=start_index, end_index=end_index,
+                                                   threads=decode_threads(), segment_timeout=SEGMENT_TIMEOUT))
+    if chat:
+        frames = distribute(frames, [chat])
+    for i, filename, frame in frames:
+        try:
+            box = detect_minimap(frame)
         except Exception as e:
             print(f"[SKIP] Frame {filename}: {e}")
+            probe_frames = []
             continue
+        if probe_frames and not same_box(box, probe_frames[0][3]):
+            probe_frames = []
+        probe_frames.append((i, filename, frame, box))
+        if len(probe_frames) >= MINIMAP_PROBE_FRAMES:
+            break
+    frames.close()
+    if not probe_frames:
+        return
+
+    start_frame_index, start_filename, first_frame, box = probe_frames[0]
+    print(f"[MINIMAP] Detected in frame {start_filename} with box {box}")
+    save_minimap_position(first_frame, box, start_filename)
+    x, y, w, h = box
+    for i, filename, frame, _ in probe_frames:
+        yield {
+            "index": i,
+            "filename": filename,
+            "timestamp": (i - start_frame_index) / FPS,
+            "minimap": frame[y:y+h, x:x+w].copy(),
+            "box": box,
+            "miss_counter": 0,
+            "scale": 1.0
+        }
+    if len(probe_frames) < MINIMAP_PROBE_FRAMES:
+        return  # video ended while probing
+
+    yield from decode_minimap_region(box, first_frame.shape[:2], start_frame_index, probe_frames[-1][0] + FRAME_SKIP,
+                                     end_index=end_index)
+
+def decode_minimap_region(box, frame_size, start_frame_index, next_index, miss_counter=0, end_index=None):
+    # Phase 2: ffmpeg crops (and optionally scales) the region around the minimap, nothing else leaves the decoder
+    x, y, w, h = box
+    frame_height, frame_width = frame_size
+    region_x, region_y = max(x - CROP_MARGIN, 0), max(y - CROP_MARGIN, 0)
+    region_w = min(x + w + CROP_MARGIN, frame_width) - region_x
+    region_h = min(y + h + CROP_MARGIN, frame_height) - region_y
+    decode_x, decode_y, decode_w, decode_h = region_x, region_y, region_w, region_h
+    scale = CROP_DECODE_SIZE
+    if chat:
+        # the chat region comes out of the same decode, unscaled for the OCR
+        chat.box = chat.box or chat.clip(frame_size)
+        chat_x, chat_y, chat_w, chat_h = chat.box
+        decode_x, decode_y = min(region_x, chat_x), min(region_y, chat_y)
+        decode_w = max(region_x + region_w, chat_x + chat_w) - decode_x
+        decode_h = max(region_y + region_h, chat_y + chat_h) - decode_y
+        if scale:
+            print("[INFO] crop_decode_size is ignored while the chat region is decoded too")
+            scale = None
+    factor = scale / w if scale else 1.0
+    size = (round(decode_w * factor), round(decode_h * factor)) if scale else None
+    offset_x, offset_y = round((x - decode_x) * factor), round((y - decode_y) * factor)
+    minimap_w, minimap_h = round(w * factor), round(h * factor)
+    margin_x, margin_y = round((region_x - decode_x) * factor), round((region_y - decode_y) * factor)
+    margin_w, margin_h = round(region_w * factor), round(region_h * factor)
+    min_score = MINIMAP_SCORE_THRESHOLD * factor * factor
+    _, signature = minimap_reference["current"]
+    print(f"[INFO] Decoding only region x={decode_x}, y={decode_y}, w={decode_w}, h={decode_h} (size {size or 'unscaled'})")
+
+    regions = timer.iterate("decode", stream_frames(VIDEO_PATH, FPS, FRAME_SKIP, start_index=next_index, end_index=end_index,
+                                                    crop=(decode_x, decode_y, decode_w, decode_h), size=size,
+                                                    threads=decode_threads(), segment_timeout=SEGMENT_TIMEOUT))
+    if chat:
+        regions = distribute(regions, [lambda item: chat(item, origin=(decode_x, decode_y))])
+    for i, filename, region in regions:
+        minimap = region[offset_y:offset_y+minimap_h, offset_x:offset_x+minimap_w].copy()
+        try:
+            if not minimap_present(minimap, signature):
+                area = region[margin_y:margin_y+margin_h, margin_x:margin_x+margin_w]
+                _ = detect_minimap(area, roi_fraction=1.0, min_score=min_score)
+            miss_counter = 0
+        except:
+            miss_counter += 1
+            print(f"[MISS] Frame {filename}: Minimap not visible ({miss_counter}/{MAX_CONSECUTIVE_MISSES})")
+
+        yield {
+            "index": i,
+            "filename": filename,
+            "timestamp": (i - start_frame_index) / FPS,
+            "minimap": minimap,
+            "box": box,
+            "miss_counter": miss_counter,
+            "scale": 1.0 / factor
+        }
+
+def get_minimaps(checkpoint=None, start_index=0, end_index=None):
+    if CROP_DECODE and not SAVE_FRAMES:
+        minimaps = crop_minimaps_region_decode(checkpoint, start_index, end_index)
+        return threaded(minimaps, PIPELINE_QUEUE_SIZE) if PIPELINE else minimaps
+    if checkpoint:
+        start_index = checkpoint["last_index"] + FRAME_SKIP
+        end_index = checkpoint.get("end_index")
+    frames = sampled_frames(get_frames(start_index, end_index), start_index)
+    if chat:
+        frames = distribute(frames, [chat])
+    if not PIPELINE:
+        return crop_minimaps(map(check_frame, frames), checkpoint)
+
+    # decode stage (with the chat region as a second consumer) -> parallel minimap check -> in-order miss counting and cropping
+    frames = threaded(frames, PIPELINE_QUEUE_SIZE)
+    checked_frames = ordered_map(check_frame, frames, PIPELINE_WORKERS["preprocess"], PIPELINE_QUEUE_SIZE)
+    return threaded(crop_minimaps(checked_frames, checkpoint), PIPELINE_QUEUE_SIZE)
+
+def skip_unchanged(minimaps):
+    # compares each crop with the last crop that went through inference, not with the previous frame, so slow drift is still caught
+    last_inferred = None
+    for item in minimaps:
+        with timer.stage("change_gate"):
+            small = cv2.resize(cv2.cvtColor(item["minimap"], cv2.COLOR_BGR2GRAY), (CHANGE_SIZE, CHANGE_SIZE),
+                               interpolation=cv2.INTER_AREA)
+        if last_inferred is not None and cv2.absdiff(small, last_inferred).mean() < CHANGE_THRESHOLD:
+            item["carried_forward"] = True
+            item["minimap"] = None
+        else:
+            last_inferred = small
+        yield item
+
+def predict_batch(batch):
+    inferred = [item for item in batch if not item.get("carried_forward")]
+    try:
+        with timer.stage("color_conversion", len(inferred)):
+            images = [PILImage.fromarray(cv2.cvtColor(item["minimap"], cv2.COLOR_BGR2RGB)) for item in inferred]
+        predictions = iter(get_predictions_from_images(images) if images else [])
+        # carried forward frames get None, the writer fills in the last inferred predictions
+        return batch, [None if item.get("carried_forward") else next(predictions) for item in batch]
+    except Exception as e:
+        print(f"[SKIP] Frames {batch[0]['filename']} to {batch[-1]['filename']}: {e}")
+        return batch, None
+
+def predict_minimaps(minimaps):
+    if TRACKING:
+        return threaded(predict_tracked(minimaps), PIPELINE_QUEUE_SIZE) if PIPELINE else predict_tracked(minimaps)
+    if ADAPTIVE_SAMPLING:
+        return threaded(predict_adaptive(minimaps), PIPELINE_QUEUE_SIZE) if PIPELINE else predict_adaptive(minimaps)
+    if CHANGE_THRESHOLD > 0:
+        minimaps = skip_unchanged(minimaps)
+    batches = batched(minimaps, INFERENCE_BATCH_SIZE, lambda item: not item.get("carried_forward"))
+    if not PIPELINE:
+        return map(predict_batch, batches)
+    workers = PIPELINE_WORKERS["inference"]
+    return threaded(ordered_map(predict_batch, batches, workers, workers * 2), PIPELINE_QUEUE_SIZE)
+
+def box_center(prediction):
+    x1, y1, x2, y2 = prediction[:4]
+    return (x1 + x2) / 2, (y1 + y2) / 2
+
+def detections_changed(previous, current):
+    # new ping classes or a large champion move between two sparse samples
+    previous_pings = {p[4] for p in previous if p[4] in PING_NAMES}
+    if any(p[4] in PING_NAMES and p[4] not in previous_pings for p in current):
+        return True
+    previous_champions = {p[4]: box_center(p) for p in previous if p[4] not in PING_NAMES}
+    for p in current:
+        if p[4] in previous_champions:
+            (px, py), (cx, cy) = previous_champions[p[4]], box_center(p)
+            if ((cx - px) ** 2 + (cy - py) ** 2) ** 0.5 > ADAPTIVE_MOVE_PX:
+                return True
+    return False
 
+def sparse_groups(minimaps):
+    # yields (skipped items, sparse item), the last frame is always a sparse item
+    window = []
+    for n, item in enumerate(minimaps):
+        if n % ADAPTIVE_SPARSE_SKIP == 0:
+            yield window, item
+            window = []
+        else:
+            window.append(item)
+    if window:
+        yield window[:-1], window[-1]
+
+def predict_adaptive(minimaps):
+    previous = None
+    inferred = 0
+    sampled = 0
+    try:
+        for chunk in batched(sparse_groups(minimaps), INFERENCE_BATCH_SIZE):
+            _, sparse_predictions = predict_batch([item for _, item in chunk])
+            if sparse_predictions is None:
+                continue
+            inferred += len(chunk)
+
+            # go back to the skipped frames of a window when the sparse samples around it differ, as long as the budget allows
+            densify = []
+            for (window, item), predictions in zip(chunk, sparse_predictions):
+                sampled += len(window) + 1
+                active = previous is not None and detections_changed(previous, predictions)
+                active = active or any(w["miss_counter"] > 0 for w in window + [item])  # dense around the match end
+                densify.append(bool(window) and active and inferred + len(window) <= ADAPTIVE_BUDGET * sampled)
+                if densify[-1]:
+                    inferred += len(window)
+                previous = predictions
+
+            dense_items = [w for (window, _), dense in zip(chunk, densify) if dense for w in window]
+            dense_predictions = predict_batch(dense_items)[1] if dense_items else []
+            if dense_predictions is None:
+                densify = [False] * len(chunk)
+            dense_predictions = iter(dense_predictions or [])
+
+            batch = []
+            batch_predictions = []
+            for (window, item), predictions, dense in zip(chunk, sparse_predictions, densify):
+                if dense:
+                    for w in window:
+                        batch.append(w)
+                        batch_predictions.append(next(dense_predictions))
+                batch.append(item)
+                batch_predictions.append(predictions)
+            yield batch, batch_predictions
+    finally:
+        if sampled:
+            print(f"[INFO] Adaptive sampling: {inferred} of {sampled} sampled frames inferred")
+
+def predict_tracked(minimaps):
+    # detector frames are batched per chunk in advance, tracker frames fall back to a single detector run when a track is lost
+    tracker = MinimapTracker()
+    detected = 0
+    total = 0
+    try:
+        for chunk in batched(minimaps, INFERENCE_BATCH_SIZE * TRACK_EVERY):
+            _, scheduled_predictions = predict_batch(chunk[::TRACK_EVERY])
+            if scheduled_predictions is None:
+                continue
+            scheduled = dict(zip(range(0, len(chunk), TRACK_EVERY), scheduled_predictions))
+            detected += len(scheduled)
+            total += len(chunk)
+
+            batch_predictions = []
+            for n, item in enumerate(chunk):
+                gray = cv2.cvtColor(item["minimap"], cv2.COLOR_BGR2GRAY)
+                predictions = scheduled.get(n)
+                if predictions is None:
+                    with timer.stage("tracking"):
+                        predictions, track_ids, lowest_score = tracker.predict(gray)
+                    fallback = predict_batch([item])[1] if lowest_score < TRACK_MIN_SCORE else None
+                    if fallback is None:
+                        # carried boxes score track confidence x match score, the same threshold as the detector applies
+                        kept = [n for n, prediction in enumerate(predictions) if prediction[5] >= CONFIDENCE_THRESHOLD]
+                        predictions = [predictions[n] for n in kept]
+                        item["tracked"] = True
+                        item["track_ids"] = [track_ids[n] for n in kept]
+                    else:
+                        predictions = fallback[0]
+                        detected += 1
+                if not item.get("tracked"):
+                    item["track_ids"] = tracker.update(item["index"], predictions, gray)
+                batch_predictions.append(predictions)
+            yield chunk, batch_predictions
+    finally:
+        if total:
+            print(f"[INFO] Tracking: detector ran on {detected} of {total} frames")
+
+def run_fingerprint():
+    # what the results depend on: a checkpoint or shard plan written for another video, model or settings is not reused
+    if os.path.exists(VIDEO_PATH) and not VIDEO_PATH.endswith(".m3u8"):
+        stat = os.stat(VIDEO_PATH)
+        video = [stat.st_size, stat.st_mtime_ns]
+    else:
+        video = VIDEO_PATH  # the segments of a running download
+    digest = hashlib.sha256()
+    with open(MODEL_PATH, "rb") as f:
+        while chunk := f.read(2 ** 20):
+            digest.update(chunk)
+    return json.loads(json.dumps({  # as it reads back from checkpoint.json
+        "video": video,
+        "model": [MODEL_PATH, digest.hexdigest()],
+        "settings": {key: value for key, value in sorted(config.items()) if key not in RUNTIME_SETTINGS},
+        "constants": {name: globals()[name] for name in RESULT_CONSTANTS},
+        "roster": sorted(ROSTER_NAMES) if ROSTER_NAMES else None,
+    }))
+
+def load_checkpoint():
+    if not (RESUME or SHARD is not None) or not os.path.exists(CHECKPOINT_PATH) or not os.path.exists(RESULTS_LOG_PATH):
+        return None
+    with open(CHECKPOINT_PATH) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("fingerprint") != fingerprint:
+        print(f"[INFO] {CHECKPOINT_PATH} is from another video, model or settings, starting over")
+        return None
+    return checkpoint
+
+@timer.timed("checkpoint")
+def save_checkpoint(state):
+    # write to a temp file and rename, so a crash never leaves a half written checkpoint
+    tmp_path = CHECKPOINT_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+def new_checkpoint(end_index=None):
+    return {
+        "start_frame": None,
+        "start_frame_index": None,
+        "end_frame": None,
+        "last_frame": None,
+        "last_index": None,
+        "box": None,
+        "frame_size": None,
+        "miss_counter": 0,
+        "prediction_miss_counter": 0,
+        "empty_prediction_buffer": [],
+        "last_predictions": [],
+        "frame_count": 0,
+        "carried_count": 0,
+        "roster_positions": {},  # last center per roster champion, see constrain_to_roster()
+        "log_offset": 0,
+        "end_index": end_index,  # decoding stops before this frame index, None = end of the video
+        "fingerprint": fingerprint,
+        "finished": False
+    }
+
+def process_frames(predicted_batches, checkpoint=None, end_index=None):
+    # Writer stage: consumes (batch, predictions) in frame order and appends every frame to results.jsonl,
+    # the checkpoint after each batch holds everything needed to resume after the last written frame
+    state = checkpoint or new_checkpoint(end_index)
+    frames_before = state["frame_count"]
+
+    with open(RESULTS_LOG_PATH, "r+b" if checkpoint else "wb") as log:
+        log.truncate(state["log_offset"])  # drop lines written after the last checkpoint
+        log.seek(state["log_offset"])
+
+        for batch, batch_predictions in predicted_batches:
+            if batch_predictions is None:
+                continue
+
+            for item, predictions in zip(batch, batch_predictions):
+                filename = item["filename"]
+                timestamp = item["timestamp"]
+                if item.get("carried_forward"):
+                    predictions = state["last_predictions"]
+                    state["carried_count"] += 1
+                else:
+                    with timer.stage("postprocess"):
+                        predictions = rescale_predictions(predictions, item["scale"])
+                        if ROSTER and ROSTER_NAMES:
+                            predictions, kept = constrain_to_roster(predictions, ROSTER_NAMES, state.setdefault("roster_positions", {}))
+                            if item.get("track_ids") is not None:
+                                item["track_ids"] = [item["track_ids"][n] for n in kept]
+                    state["last_predictions"] = predictions
+                if state["start_frame"] is None:
+                    state["start_frame"] = filename
+                    state["start_frame_index"] = item["index"]
+                state["last_frame"] = filename
+                state["last_index"] = item["index"]
+                state["box"] = item["box"]
+                state["frame_size"] = minimap_reference["frame_size"]
+                state["miss_counter"] = item["miss_counter"]
+                state["frame_count"] += 1
+
+                record = {
+                    "frame": filename,
+                    "timestamp": format_timestamp(timestamp),
+                    "predictions": predictions
+                }
+                if item.get("carried_forward"):
+                    record["carried_forward"] = True
+                if item.get("tracked"):
+                    record["tracked"] = True
+                if item.get("track_ids") is not None:
+                    record["track_ids"] = item["track_ids"]
+                if item["miss_counter"] > 0:
+                    record["minimap_missing"] = True  # lets the shard merge recount the misses across shard boundaries
+                with timer.stage("serialization"):
+                    log.write((json.dumps(record) + "\n").encode("utf-8"))
+
+                if match_ended(state, filename, predictions):
+                    break
+
+            log.flush()
+            state["log_offset"] = log.tell()
+            save_checkpoint(state)
+            timer.progress(state["frame_count"], state["last_frame"])
+            if state["end_frame"]:
+                break
+
+    state["finished"] = True
+    save_checkpoint(state)
+
+    if state["last_frame"] is None:
+        if SHARD is not None:
+            print(f"[INFO] No minimap frames in shard {SHARD}")
+            return 0
+        print("[ERROR] No minimap frames found.")
+        return None
+    if CHANGE_THRESHOLD > 0:
+        print(f"[INFO] Saved {state['carried_count']} of {state['frame_count']} forward passes (unchanged minimap, threshold {CHANGE_THRESHOLD})")
+    finalize_results(state)
+    return state["frame_count"] - frames_before
+
+def match_ended(state, filename, predictions, verbose=True):
+    # state["miss_counter"] must already hold the minimap misses up to this frame
+    if not predictions:
+        state["prediction_miss_counter"] += 1
+        state["empty_prediction_buffer"].append(filename)
+        if verbose:
+            print(f"[NO PRED] Frame {filename}: No predictions ({state['prediction_miss_counter']}/{MAX_PREDICTION_MISSES})")
+    else:
+        state["prediction_miss_counter"] = 0
+        state["empty_prediction_buffer"] = []
+
+    # Matchende wenn beide Bedingungen erfüllt sind
+    if state["miss_counter"] >= MAX_CONSECUTIVE_MISSES and state["prediction_miss_counter"] >= MAX_PREDICTION_MISSES:
+        buffer = state["empty_prediction_buffer"]
+        state["end_frame"] = buffer[0] if buffer else filename
+        print(f"[END] Match likely ended at frame {state['end_frame']} (via combined condition)")
+        return True
+    return False
+
+def chat_parts():
+    names = []
+    for name in sorted(os.listdir(CHAT_PARTS_DIR)) if os.path.isdir(CHAT_PARTS_DIR) else []:
+        try:
+            probe_video(os.path.join(CHAT_PARTS_DIR, name))
+            names.append(name)
+        except (subprocess.CalledProcessError, KeyError, ValueError):
+            print(f"[SKIP] {name}: unreadable, its run was killed before the first chat frame was written")
+    return names
+
+def record_chat_range(start_index, end_index=None):
+    # the chat region alone, decoded for frames the minimap decode did not read (before and after the match)
+    source = os.path.join(CONFIG_DIR, "video.mp4")
+    if not os.path.exists(source):
+        source = VIDEO_PATH  # the download is still running, the playlist waits for its end
+    width, height, _ = probe_video(source)
+    recorder = ChatRecorder()
+    recorder.box = recorder.clip((height, width))
+    frames = stream_frames(source, FPS, FRAME_SKIP * CHAT_STEP, start_index, end_index, crop=recorder.box)
+    try:
+        for item in frames:
+            recorder(item, origin=recorder.box[:2])
+    finally:
+        frames.close()
+        recorder.close()
+
+def join_chat_parts():
+    # chat_region.mp4 from the parts of all runs and shards, each part cut where the next one starts
+    names = chat_parts()
+    if not names:
+        print(f"[INFO] No chat region frames in {CHAT_PARTS_DIR}")
+        return
+    step = FRAME_SKIP * CHAT_STEP
+    first = int(os.path.splitext(names[0])[0].split("_")[1])
+    last = int(os.path.splitext(names[-1])[0].split("_")[1])
+    _, _, duration = probe_video(os.path.join(CHAT_PARTS_DIR, names[-1]))
+    # the whole video: the chat outside the decoded window is decoded on its own, a few chat frames per second
+    if first > 0:
+        record_chat_range(0, first)
+    record_chat_range(last + round(duration * chat_fps()) * step)
+    names = chat_parts()
+    firsts = [int(os.path.splitext(name)[0].split("_")[1]) for name in names]
+    parts = [(os.path.join(CHAT_PARTS_DIR, name), -(-(following - first) // step) / chat_fps())
+             for name, first, following in zip(names, firsts, firsts[1:])]
+    parts.append((os.path.join(CHAT_PARTS_DIR, names[-1]), None))
+    os.makedirs(os.path.dirname(CHAT_VIDEO_PATH), exist_ok=True)  # chat_text/ exists only when run_pipeline.py created it
+    join_videos(parts, CHAT_VIDEO_PATH)
+    # second t of chat_region.mp4 is second start_seconds + t of video.mp4
+    with open(CHAT_INFO_PATH, "w") as f:
+        json.dump({"start_seconds": firsts[0] / FPS, "fps": chat_fps(), "region": CHAT_REGION}, f, indent=2)
+    print(f"[INFO] Chat region of {len(names)} decode runs saved to {CHAT_VIDEO_PATH}")
+
+@timer.timed("finalize")
+def finalize_results(state):
+    # builds the results.json the viewer reads from the append-only log
+    if SHARD is not None:
+        return  # shards only keep their log, merge_shards() builds results.json from all of them
+    results_dict = {}
+    with open(RESULTS_LOG_PATH, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            record.pop("minimap_missing", None)
+            results_dict[record.pop("frame")] = record
+
+    end_frame = state["end_frame"] if state["end_frame"] else state["last_frame"]
     results_dict["__meta__"] = {
-        "start_frame": start_frame,
-        "end_frame": end_frame if end_frame else frame_files[-1]
+        "start_frame": state["start_frame"],
+        "end_frame": end_frame
     }
 
     with open(os.path.join(CONFIG_DIR, "results.json"), "w") as f:
         json.dump(results_dict, f, indent=2)
 
-if __name__ == "__main__":
+    # columnar copy for the viewer, with exact timestamps instead of whole seconds
+    frames = [frame for frame in results_dict if frame != "__meta__"]
+    records = ((frame, (frame_index_from_name(frame) - state["start_frame_index"]) / FPS, results_dict[frame])
+               for frame in frames)
+    save_columns(os.path.join(CONFIG_DIR, "results.npz"), records_to_columns(records, state["start_frame"], end_frame))
+
+def shard_dir(shard):
+    return os.path.join(SHARDS_DIR, f"shard_{shard}")
+
+def minimap_at(index):
+    frame = read_frame(VIDEO_PATH, FPS, index)
+    if frame is None:
+        return False
+    try:
+        detect_minimap(frame)
+        return True
+    except ValueError:
+        return False
+
+def first_true(predicate, low, high):
+    # binary search for the smallest k in (low, high] with predicate(k), predicate(high) has to be true
+    while high - low > 1:
+        middle = (low + high) // 2
+        if predicate(middle):
+            high = middle
+        else:
+            low = middle
+    return high
+
+def locate_match():
+    """Find the frame window of the match with single-frame seeks instead of decoding the whole video.
+
+    Coarse probes every LOCATE_STEP seconds from both ends, then a binary search between the last probe without
+    and the first probe with a minimap (and vice versa at the end), all on the FRAME_SKIP sample grid.
+    Returns (start_index, end_index) for get_minimaps() or None if no probe shows a minimap.
+    """
+    _, _, duration = probe_video(VIDEO_PATH)
+    samples = int(duration * FPS) // FRAME_SKIP  # sample k is frame index k * FRAME_SKIP
+    step = max(int(LOCATE_STEP * FPS) // FRAME_SKIP, 1)
+    probes = []
+
+    def present(k):
+        probes.append(k)
+        return k < samples and minimap_at(k * FRAME_SKIP)
+
+    coarse = list(range(0, samples, step))
+    first = next((k for k in coarse if present(k)), None)
+    if first is None:
+        return None
+    last = next(k for k in reversed(coarse) if k <= first or present(k))
+    start = first_true(present, first - step if first else -1, first)
+    end = first_true(lambda k: not present(k), last, min(last + step, samples))  # first sample without minimap
+
+    # the full pass still has to see the misses that trigger the end condition
+    end_index = (end + MAX_CONSECUTIVE_MISSES + MAX_PREDICTION_MISSES) * FRAME_SKIP
+    print(f"[INFO] Match located from {frame_name(start * FRAME_SKIP)} to {frame_name((end - 1) * FRAME_SKIP)} "
+          f"({len(probes)} probes, {samples} sampled frames)")
+    return start * FRAME_SKIP, end_index
+
+def find_match_start(start_index=0):
+    # the start frame is located once up front, so every shard counts its timestamps from the same frame
+    frames = get_frames(start_index)
+    try:
+        for i, filename, frame, box, error, _ in map(check_frame, sampled_frames(frames, start_index)):
+            if error is None:
+                print(f"[MINIMAP] Detected in frame {filename} with box {box}")
+                save_minimap_position(frame, box, filename)
+                return i, box, frame.shape[:2]
+            print(f"[SKIP] Frame {filename}: {error}")
+    finally:
+        frames.close()
+    return None
+
+def plan_shards():
+    if RESUME and os.path.exists(SHARD_PLAN_PATH):
+        with open(SHARD_PLAN_PATH) as f:
+            plan = json.load(f)
+        if plan.get("fingerprint") == fingerprint:
+            return plan
+        print(f"[INFO] {SHARD_PLAN_PATH} is from another video, model or settings, planning again")
+    window = locate_match() if LOCATE_MATCH else None
+    start = find_match_start(window[0] if window else 0)
+    if start is None:
+        return None
+    start_index, box, frame_size = start
+    if window:
+        end_index = window[1]
+    else:
+        _, _, duration = probe_video(VIDEO_PATH)
+        end_index = int(duration * FPS)
+
+    # shard boundaries on the FRAME_SKIP grid, so the shards together sample exactly the frames of a single run
+    step = max(-(-(end_index - start_index) // (SHARDS * FRAME_SKIP)) * FRAME_SKIP, FRAME_SKIP)
+    bounds = list(range(start_index, end_index, step))
+    plan = {
+        "start_frame": frame_name(start_index),
+        "start_frame_index": start_index,
+        "box": box,
+        "frame_size": frame_size,
+        # the last shard ends with the located window, without one at the end of the video (the duration is rounded)
+        "shards": [[first, last] for first, last in zip(bounds, bounds[1:] + [end_index if window else None])],
+        "fingerprint": fingerprint,
+    }
+
+    # every shard starts as a resumed run: minimap already found, nothing written before its first frame
+    for shard, (first, last) in enumerate(plan["shards"]):
+        os.makedirs(shard_dir(shard), exist_ok=True)
+        state = new_checkpoint()
+        state.update(start_frame=plan["start_frame"], start_frame_index=start_index, last_index=first - FRAME_SKIP,
+                     box=box, frame_size=frame_size, end_index=last)
+        with open(os.path.join(shard_dir(shard), "checkpoint.json"), "w") as f:
+            json.dump(state, f)
+        open(os.path.join(shard_dir(shard), "results.jsonl"), "wb").close()
+    with open(SHARD_PLAN_PATH, "w") as f:
+        json.dump(plan, f)
+    return plan
+
+def run_shards(plan):
+    # one process with its own model per shard, torch threads split between them
+    env = dict(os.environ, OMP_NUM_THREADS=str(max((os.cpu_count() or 1) // len(plan["shards"]), 1)))
+    processes = []
+    for shard, (first, last) in enumerate(plan["shards"]):
+        with open(os.path.join(shard_dir(shard), "checkpoint.json")) as f:
+            if json.load(f)["finished"]:
+                print(f"[INFO] Shard {shard} already finished")
+                continue
+        print(f"[INFO] Shard {shard}: frames {frame_name(first)} to {frame_name(last - FRAME_SKIP) if last else 'end'}")
+        log = open(os.path.join(shard_dir(shard), "predict.log"), "a")
+        cmd = [sys.executable, os.path.abspath(__file__), config_path, "--shard", str(shard)]
+        processes.append((shard, log, subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)))
+
+    failed = []
+    for shard, log, process in processes:
+        process.wait()
+        log.close()
+        if process.returncode != 0:
+            failed.append(shard)
+    if failed:
+        raise RuntimeError(f"[ERROR] Shards {failed} failed, see {SHARDS_DIR}/shard_*/predict.log")
+
+def merge_shards(plan):
+    # concatenates the shard logs in time order and recounts the misses, so the match end is found across shard boundaries
+    state = new_checkpoint()
+    state.update(start_frame=plan["start_frame"], start_frame_index=plan["start_frame_index"],
+                 box=plan["box"], frame_size=plan["frame_size"])
+    with open(RESULTS_LOG_PATH, "wb") as log:
+        for shard in range(len(plan["shards"])):
+            with open(os.path.join(shard_dir(shard), "results.jsonl"), encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    state["miss_counter"] = state["miss_counter"] + 1 if record.get("minimap_missing") else 0
+                    state["last_frame"] = record["frame"]
+                    state["frame_count"] += 1
+                    state["carried_count"] += bool(record.get("carried_forward"))
+                    log.write(line.encode("utf-8"))
+                    if match_ended(state, record["frame"], record["predictions"], verbose=False):
+                        break
+            if state["end_frame"]:
+                break
+        state["log_offset"] = log.tell()
+    state["finished"] = True
+    save_checkpoint(state)
+
+    if state["last_frame"] is None:
+        print("[ERROR] No minimap frames found.")
+        return None
+    finalize_results(state)
+    return state["frame_count"]
+
+def run(path, match_config=None, shard=None, detector=None):
+    """Predict a match video, the command line entry point and the in-process stage of run_pipeline.py.
+
+    detector is an already loaded model to use instead of the inference service or loading best.pt. Returns the number
+    of predicted frames, None if no minimap was found.
+    """
+    try:
+        return predict_match(path, match_config, shard, detector)
+    finally:
+        close_services()
+
+def predict_match(path, match_config, shard, detector):
+    global service, model, chat, fingerprint, VIDEO_PATH, SHARDS, LOCATE_MATCH, SAVE_FRAMES
+    configure(path, match_config, shard)
+    service = None if detector else connect_service()
+    if service:
+        print(f"[INFO] Using the inference service at {SERVICE_ADDRESS}")
+    model = detector or (None if service else shared_model())
+    chat = None  # only the runs that decode frames record the chat region
+
+    if PROGRESSIVE and not os.path.exists(VIDEO_PATH):
+        print(f"[INFO] No {VIDEO_PATH} yet, reading the segments of the download in {SEGMENTS_PLAYLIST}")
+        if not wait_for_playlist(SEGMENTS_PLAYLIST, SEGMENT_TIMEOUT):
+            raise FileNotFoundError(f"[ERROR] No segment in {SEGMENTS_PLAYLIST} after {SEGMENT_TIMEOUT}s")
+        VIDEO_PATH = SEGMENTS_PLAYLIST
+        if SHARDS > 1 or LOCATE_MATCH or SAVE_FRAMES:
+            print("[INFO] shards, locate_match and save_frames need the whole video, they are off while it downloads")
+            SHARDS, LOCATE_MATCH, SAVE_FRAMES = 1, False, False
     if not os.path.exists(VIDEO_PATH):
         raise FileNotFoundError(f"[ERROR] Video file not found at: {VIDEO_PATH}")
-    print("[INFO] Extracting frames...")
-    extract_frames(VIDEO_PATH, FRAMES_DIR, FPS)
+    fingerprint = run_fingerprint()
+    checkpoint = load_checkpoint()
+    if checkpoint and checkpoint["finished"]:
+        print("[INFO] Checkpoint is finished, only writing results.json")
+        if checkpoint["last_frame"] is None:
+            return None
+        finalize_results(checkpoint)
+        if CHAT_REGION:
+            join_chat_parts()
+        return checkpoint["frame_count"]
+    if CHAT_REGION and SHARD is None and not checkpoint and not (SHARDS > 1 and RESUME and os.path.exists(SHARD_PLAN_PATH)):
+        shutil.rmtree(CHAT_PARTS_DIR, ignore_errors=True)  # parts of an earlier run, this one decodes from the start
+    if SHARDS > 1 and SHARD is None and not SAVE_FRAMES:
+        print(f"[INFO] Processing frames in {SHARDS} shards...")
+        start_time = timer.start = time.perf_counter()
+        plan = plan_shards()
+        if plan is None:
+            print("[ERROR] No minimap frames found.")
+            return None
+        run_shards(plan)
+        frame_count = merge_shards(plan)
+        if frame_count is None:
+            return None
+        if CHAT_REGION:
+            join_chat_parts()
+        elapsed = time.perf_counter() - start_time
+        print(f"[INFO] {frame_count} frames in {elapsed:.1f}s ({frame_count / elapsed:.2f} frames/s, {len(plan['shards'])} shards)")
+        timer.report(frame_count, TIMING_PATH)  # orchestrator only, every shard saves its own timing.json
+        print(f"[DONE] Saved minimap to {MINIMAP_POS_DIR} and results to results.json")
+        return frame_count
+    if checkpoint:
+        restore_minimap_position(checkpoint)
+
     print("[INFO] Processing frames...")
-    process_frames()
+    start_time = timer.start = time.perf_counter()
+    window = (0, None)
+    if LOCATE_MATCH and not checkpoint and not SAVE_FRAMES:
+        window = locate_match() or window
+    chat = ChatRecorder() if CHAT_REGION else None
+    predicted_batches = predict_minimaps(get_minimaps(checkpoint, *window))
+    try:
+        frame_count = process_frames(predicted_batches, checkpoint, window[1])
+    finally:
+        if hasattr(predicted_batches, "close"):
+            predicted_batches.close()
+        if chat:
+            chat.close()
+    if frame_count is None:
+        return None
+    if CHAT_REGION and SHARD is None:
+        join_chat_parts()  # after the last part is closed
+    elapsed = time.perf_counter() - start_time
+    print(f"[INFO] {frame_count} frames in {elapsed:.1f}s ({frame_count / elapsed:.2f} frames/s, batch size {INFERENCE_BATCH_SIZE})")
+    timer.report(frame_count, TIMING_PATH)
     print(f"[DONE] Saved minimap to {MINIMAP_POS_DIR} and results to results.json")
+    return frame_count
+
+def main():
+    shard = int(sys.argv[sys.argv.index("--shard") + 1]) if "--shard" in sys.argv else None
+    if run(sys.argv[1] if len(sys.argv) > 1 else "config.json", shard=shard) is None:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
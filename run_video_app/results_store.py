@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import glob
+import struct
+import zipfile
+import argparse
+from collections.abc import Mapping
+import numpy as np
+import yaml
+from video_frames import frame_name
+
+# Columnar results store: one row per frame (frame_index, timestamp, carried_forward, offsets into the detection
+# columns) and one row per detection (class_id, box, confidence). Saved as uncompressed .npz, so every column can be
+# memory-mapped straight out of the zip file.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CLASSES_PATH = os.path.join(SCRIPT_DIR, "..", "minimap.yaml")
+
+with open(CLASSES_PATH) as f:
+    CLASS_NAMES = yaml.safe_load(f)["names"]
+CLASS_IDS = {name: i for i, name in enumerate(CLASS_NAMES)}
+
+def frame_index_from_name(filename):
+    # inverse of video_frames.frame_name(): frame_0001.png -> 0
+    return int(os.path.splitext(filename)[0].split("_")[-1]) - 1
+
+def format_timestamp(seconds):
+    return f"{int(seconds // 3600):02}:{int((seconds % 3600) // 60):02}:{int(seconds % 60):02}"
+
+def parse_timestamp(timestamp):
+    hours, minutes, seconds = map(int, timestamp.split(":"))
+    return hours * 3600 + minutes * 60 + seconds
+
+def records_to_columns(records, start_frame=None, end_frame=None):
+    """records: (frame filename, timestamp in seconds, results.json record of the frame) in frame order."""
+    frame_index, timestamps, carried, tracked, offsets = [], [], [], [], [0]
+    class_ids, boxes, confidences, track_ids = [], [], [], []
+    has_track_ids = False
+    for filename, timestamp, record in records:
+        frame_index.append(frame_index_from_name(filename))
+        timestamps.append(timestamp)
+        carried.append(record.get("carried_forward", False))
+        tracked.append(record.get("tracked", False))
+        has_track_ids = has_track_ids or "track_ids" in record
+        for x1, y1, x2, y2, name, confidence in record["predictions"]:
+            if name not in CLASS_IDS:
+                raise ValueError(f"Class '{name}' in {filename} is not in {CLASSES_PATH}")
+            class_ids.append(CLASS_IDS[name])
+            boxes.append((x1, y1, x2, y2))
+            confidences.append(confidence)
+        track_ids += record.get("track_ids", [-1] * len(record["predictions"]))
+        offsets.append(len(class_ids))
+
+    columns = {
+        "frame_index": np.array(frame_index, dtype=np.int32),
+        "timestamp": np.array(timestamps, dtype=np.float32),
+        "carried_forward": np.array(carried, dtype=bool),
+        "tracked": np.array(tracked, dtype=bool),
+        "offsets": np.array(offsets, dtype=np.int64),  # detections of frame n are offsets[n]:offsets[n + 1]
+        "class_id": np.array(class_ids, dtype=np.int16),
+        "box": np.array(boxes, dtype=np.int16).reshape(-1, 4),
+        "confidence": np.array(confidences, dtype=np.float32),
+        "start_frame_index": np.int32(-1 if start_frame is None else frame_index_from_name(start_frame)),
+        "end_frame_index": np.int32(-1 if end_frame is None else frame_index_from_name(end_frame)),
+    }
+    if has_track_ids:
+        columns["track_id"] = np.array(track_ids, dtype=np.int64)  # only written by the tracking mode
+    return columns
+
+def json_to_columns(results_dict):
+    meta = results_dict.get("__meta__", {})
+    frames = sorted((key for key in results_dict if key != "__meta__"), key=frame_index_from_name)
+    records = ((frame, parse_timestamp(results_dict[frame]["timestamp"]), results_dict[frame]) for frame in frames)
+    return records_to_columns(records, meta.get("start_frame"), meta.get("end_frame"))
+
+def save_columns(path, columns):
+    # uncompressed on purpose, compressed members cannot be memory-mapped
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **columns)
+    os.replace(tmp_path, path)
+
+def load_columns(path, mmap=True):
+    if not mmap:
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    # np.load ignores mmap_mode for .npz, so map each stored .npy member at its offset in the zip file
+    columns = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        if any(info.compress_type != zipfile.ZIP_STORED for info in archive.infolist()):
+            return load_columns(path, mmap=False)
+        for info in archive.infolist():
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))  # local file header, see the zip spec
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[:-len(".npy")]
+            if not shape:
+                columns[name] = np.frombuffer(f.read(dtype.itemsize), dtype=dtype)[0]
+            elif 0 in shape:
+                columns[name] = np.zeros(shape, dtype=dtype)
+            else:
+                columns[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                          order="F" if fortran_order else "C")
+    return columns
+
+class ColumnarResults(Mapping):
+    """Read-only view with the same keys and values as results.json, rows are only built when a frame is accessed."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.frames = [frame_name(int(i)) for i in columns["frame_index"]]
+        self.rows = {frame: n for n, frame in enumerate(self.frames)}
+
+    def predictions(self, row):
+        start, end = self.columns["offsets"][row], self.columns["offsets"][row + 1]
+        boxes = self.columns["box"][start:end].tolist()
+        class_ids = self.columns["class_id"][start:end].tolist()
+        confidences = self.columns["confidence"][start:end].tolist()
+        return [[*box, CLASS_NAMES[class_id], round(confidence, 2)]
+                for box, class_id, confidence in zip(boxes, class_ids, confidences)]
+
+    def meta(self):
+        meta = {}
+        for key in ("start_frame", "end_frame"):
+            index = int(self.columns[f"{key}_index"])
+            if index >= 0:
+                meta[key] = frame_name(index)
+        return meta
+
+    def __getitem__(self, frame):
+        if frame == "__meta__":
+            return self.meta()
+        row = self.rows[frame]
+        record = {
+            "timestamp": format_timestamp(float(self.columns["timestamp"][row])),
+            "predictions": self.predictions(row)
+        }
+        if self.columns["carried_forward"][row]:
+            record["carried_forward"] = True
+        if "tracked" in self.columns and self.columns["tracked"][row]:
+            record["tracked"] = True
+        if "track_id" in self.columns:
+            start, end = self.columns["offsets"][row], self.columns["offsets"][row + 1]
+            record["track_ids"] = self.columns["track_id"][start:end].tolist()
+        return record
+
+    def __iter__(self):
+        yield from self.frames
+        yield "__meta__"
+
+    def __len__(self):
+        return len(self.frames) + 1
+
+def load_results(match_dir, mmap=True):
+    # prefers results.npz, falls back to the results.json of older runs
+    npz_path = os.path.join(match_dir, "results.npz")
+    if os.path.exists(npz_path):
+        return ColumnarResults(load_columns(npz_path, mmap))
+    with open(os.path.join(match_dir, "results.json")) as f:
+        return json.load(f)
+
+def convert_to_npz(json_path):
+    with open(json_path) as f:
+        columns = json_to_columns(json.load(f))
+    npz_path = os.path.splitext(json_path)[0] + ".npz"
+    save_columns(npz_path, columns)
+    return npz_path
+
+def convert_to_json(npz_path):
+    results = ColumnarResults(load_columns(npz_path))
+    json_path = os.path.splitext(npz_path)[0] + ".json"
+    with open(json_path, "w") as f:
+        json.dump(dict(results.items()), f, indent=2)
+    return json_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert results.json <-> columnar results.npz")
+    parser.add_argument("paths", nargs="*", help="results.json (-> .npz) or results.npz (-> .json)")
+    parser.add_argument("--all", action="store_true", help="convert every data/match_*/results.json to .npz")
+    args = parser.parse_args()
+
+    paths = args.paths
+    if args.all:
+        paths += sorted(glob.glob(os.path.join(SCRIPT_DIR, "data", "match_*", "results.json")))
+    if not paths:
+        parser.print_help()
+        sys.exit(1)
+    for path in paths:
+        converted = convert_to_npz(path) if path.endswith(".json") else convert_to_json(path)
+        print(f"[DONE] {path} ({os.path.getsize(path) // 1024} KB) -> {converted} ({os.path.getsize(converted) // 1024} KB)")
@@ -0,0 +1,66 @@
+import os
+import re
+import json
+
+CHAMP_MAP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "champMap.json")
+with open(CHAMP_MAP_PATH) as f:
+    CHAMPION_NAMES = {champ["champ_name"] for champ in json.load(f).values()}
+
+# leagueofgraphs names that do not reduce to the class name by dropping spaces and punctuation
+ALIASES = {"wukong": "MonkeyKing", "nunuwillump": "Nunu", "renataglasc": "Renata"}
+NORMALIZED_NAMES = {re.sub(r"[^a-z0-9]", "", name.lower()): name for name in CHAMPION_NAMES}
+
+def champion_class_name(name):
+    # "Kai'Sa" -> "Kaisa", "Miss Fortune" -> "MissFortune", None if there is no such class
+    key = re.sub(r"[^a-z0-9]", "", name.lower())
+    return ALIASES.get(key) or NORMALIZED_NAMES.get(key)
+
+def load_roster(champion_teams_path):
+    # the class names of the champions in champion_teams.json (written by scrapeWebData.py)
+    with open(champion_teams_path) as f:
+        champions = [c["champion"] for c in json.load(f)]
+    roster = set()
+    for champion in champions:
+        class_name = champion_class_name(champion)
+        if class_name is None:
+            print(f"[INFO] Champion '{champion}' from {champion_teams_path} has no minimap class, ignored")
+        else:
+            roster.add(class_name)
+    return roster
+
+def box_center(prediction):
+    x1, y1, x2, y2 = prediction[:4]
+    return (x1 + x2) / 2, (y1 + y2) / 2
+
+def constrain_to_roster(predictions, roster, last_positions, max_distance=40):
+    """Limit the champion predictions of one frame to the match roster.
+
+    Keeps the most confident box per roster champion. Out-of-roster boxes and extra boxes of a champion are
+    remapped to the roster champion that is missing in this frame and was last seen closest to the box (within
+    max_distance px), otherwise dropped. Pings pass through unchanged. last_positions (champion -> center) is
+    updated in place and has to be carried from frame to frame in frame order.
+    Returns the new predictions and the indices of the input predictions they come from.
+    """
+    champion_indices = [n for n, p in enumerate(predictions) if p[4] in CHAMPION_NAMES]
+    names = {}
+    leftover = []
+    for n in sorted(champion_indices, key=lambda n: -predictions[n][5]):
+        name = predictions[n][4]
+        if name in roster and name not in names.values():
+            names[n] = name
+        else:
+            leftover.append(n)
+
+    for n in leftover:
+        cx, cy = box_center(predictions[n])
+        missing = [c for c in roster if c not in names.values() and c in last_positions]
+        distances = {c: ((last_positions[c][0] - cx) ** 2 + (last_positions[c][1] - cy) ** 2) ** 0.5 for c in missing}
+        nearest = min(distances, key=distances.get, default=None)
+        if nearest is not None and distances[nearest] <= max_distance:
+            names[n] = nearest
+
+    kept = [n for n, p in enumerate(predictions) if p[4] not in CHAMPION_NAMES or n in names]
+    constrained = [predictions[n] if n not in names else predictions[n][:4] + [names[n], predictions[n][5]] for n in kept]
+    for n, name in names.items():
+        last_positions[name] = box_center(predictions[n])
+    return constrained, kept
@@ -1,65 +1,568 @@
 import os
+import ast
+import glob
+import shutil
+import hashlib
+import argparse
 import subprocess
 import json
 import time
 import sys
+import threading
+import psutil
+
+PREDICT_CONSTANTS = ["MODEL_PATH", "FPS", "FRAME_SKIP", "CONFIDENCE_THRESHOLD", "MINIMAP_SCORE_THRESHOLD",
+                     "MAX_CONSECUTIVE_MISSES", "MAX_PREDICTION_MISSES"]  # module-level settings of predict_video.py in the manifest
+PREDICT_MODULES = ["predict_video.py", "video_frames.py", "vod_segments.py", "frame_pipeline.py", "results_store.py",
+                   "tracking.py", "roster.py", "stage_timing.py", os.path.join("..", "inference_backends.py"),
+                   os.path.join("..", "inference_service.py")]  # the code of the predict stage, a change reruns it
+VOD_KEYS = ["vod_id", "vod_timestamp", "game_duration_ms", "local_vod"]  # the video the download stage fetches
+
+def file_digest(path, known=None):
+    # sha256 of a file, or of all files below a directory; a file with the size and mtime recorded in known is not read again
+    if glob.has_magic(path):
+        # a pattern output like chat_log_*.txt: the matching files together, like a directory
+        matches = sorted(glob.glob(path))
+        if not matches:
+            return None
+        digest = hashlib.sha256()
+        for match in matches:
+            digest.update(os.path.basename(match).encode())
+            digest.update(file_digest(match)["sha256"].encode())
+        return {"sha256": digest.hexdigest()}
+    if not os.path.exists(path):
+        return None
+    if os.path.isdir(path):
+        digest = hashlib.sha256()
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                digest.update(file_digest(file_path)["sha256"].encode())
+        return {"sha256": digest.hexdigest()}
+    stat = os.stat(path)
+    if known and known.get("size") == stat.st_size and known.get("mtime_ns") == stat.st_mtime_ns:
+        return known
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(2 ** 20):
+            digest.update(chunk)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+
+def output_written(path, since=None):
+    # a pattern output counts only with a match written after since (the stage start), older ones are from earlier runs
+    if glob.has_magic(path):
+        return any(since is None or os.path.getmtime(match) >= since for match in glob.glob(path))
+    return os.path.exists(path)
+
+def same_digest(a, b):
+    return (a or {}).get("sha256") == (b or {}).get("sha256")
+
+def script_constants(path, names):
+    # literal module-level assignments like FPS = 2, read without running the script
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            if node.targets[0].id in names:
+                try:
+                    constants[node.targets[0].id] = ast.literal_eval(node.value)
+                except ValueError:
+                    pass
+    return constants
+
+# config keys without effect on the results, the same set predict_video.py leaves out of its checkpoint fingerprint
+RUNTIME_KEYS = script_constants(os.path.join(os.path.dirname(os.path.abspath(__file__)), "predict_video.py"),
+                                ["RUNTIME_SETTINGS"])["RUNTIME_SETTINGS"]
+
+class Stage:
+    """One pipeline step: a command, the files it needs and the files it writes, and the resources it may take.
+
+    A stage with a function runs it in this process instead of the command (the command line stays the fallback),
+    stages with the same exclusive name never run at the same time. Outputs in streams can be read while the stage
+    still runs (the segment playlist of a progressive download). With a manifest path the stage is cached: after a successful run the manifest records its settings (params, a dict
+    or a function returning one) and the digests of the files it read (files, default the inputs) and wrote. A later
+    run skips the stage while all of them are unchanged. When it runs again after a successful run, the paths in state
+    (what an interrupted run of the stage resumes from) are removed first.
+    An output may be a glob pattern for files the command names itself (chat_log_<timestamp>.txt), it counts as written
+    only with a match newer than the start of the stage.
+    """
+
+    def __init__(self, name, command, inputs=(), outputs=(), cpus=1, memory_mb=256, network=False, manifest=None,
+                 params=None, files=None, function=None, exclusive=None, streams=(), state=()):
+        self.name = name
+        self.command = command
+        self.function = function
+        self.exclusive = exclusive
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.streams = set(streams)
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.network = network  # network-bound stages take a network slot instead of CPUs and memory
+        self.manifest = manifest
+        self.params = params
+        self.files = list(self.inputs if files is None else files)
+        self.state = list(state)
+        self.status = "pending"  # pending, running, done, cached, failed, skipped
+        self.checked = False
+        self.start = None
+        self.started_at = None  # wall clock time of the start, for the mtimes of pattern outputs
+        self.end = None
+
+    def duration(self):
+        return self.end - self.start if self.start is not None and self.end is not None else 0.0
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def fingerprint(self, previous=None):
+        known = (previous or {}).get("inputs", {})
+        params = self.params() if callable(self.params) else self.params
+        return {"params": params or {}, "inputs": {path: file_digest(path, known.get(path)) for path in self.files}}
+
+    def up_to_date(self):
+        # (True, None) if the manifest matches, else (False, what changed)
+        previous = self.load_manifest()
+        if previous is None:
+            return False, "no manifest"
+        current = self.fingerprint(previous)
+        changed = sorted(key for key in set(current["params"]) | set(previous["params"])
+                         if current["params"].get(key) != previous["params"].get(key))
+        if changed:
+            return False, f"settings changed: {', '.join(changed)}"
+        changed = [path for path in self.files if not same_digest(current["inputs"][path], previous["inputs"].get(path))]
+        if changed:
+            return False, f"changed: {', '.join(changed)}"
+        if sorted(previous["outputs"]) != sorted(self.outputs):
+            return False, "other outputs"
+        for path, recorded in previous["outputs"].items():
+            if not same_digest(file_digest(path, recorded), recorded):
+                return False, f"output {path} missing or modified"
+        return True, None
+
+    def discard_state(self):
+        # a manifest means the last run finished: its state belongs to other inputs or settings, a resumed run would
+        # reuse it. Without a manifest the last run was interrupted and resumes from it.
+        if not self.manifest or not os.path.exists(self.manifest):
+            return
+        for path in self.state:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+            else:
+                continue
+            print(f"[INFO] {self.name}: removed {path} of the previous run")
+
+    def save_manifest(self, fingerprint):
+        os.makedirs(os.path.dirname(self.manifest), exist_ok=True)
+        manifest = {**fingerprint, "outputs": {path: file_digest(path) for path in self.outputs}, "finished": time.time()}
+        with open(self.manifest, "w") as f:
+            json.dump(manifest, f, indent=2)
 
 def load_config(config_path):
     with open(config_path, "r") as f:
         return json.load(f), config_path
 
-def run_script(script_name, config_path):
-    print(f"[INFO] Running {script_name} with {config_path}")
-    result = subprocess.run(["python", script_name, config_path])
-    if result.returncode != 0:
-        raise RuntimeError(f"[ERROR] {script_name} failed with code {result.returncode}")
-    print(f"[DONE] {script_name} completed.\n")
-
-def wait_for_file(path, timeout=120):
-    print(f"[INFO] Waiting for file: {path}")
-    waited = 0
-    while not os.path.exists(path):
-        time.sleep(1)
-        waited += 1
-        if waited > timeout:
-            raise TimeoutError(f"[ERROR] Timeout: {path} not found after {timeout} seconds.")
-    print(f"[INFO] Found file: {path}")
-
-def run_chat_extraction(video_path, match_dir):
-    chat_output_dir = os.path.join(match_dir, "chat_text")
-    os.makedirs(chat_output_dir, exist_ok=True)
+def stage_dependencies(stages):
+    # stage -> names of the stages that write its inputs
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    return {stage.name: sorted({producers[path] for path in stage.inputs if path in producers}) for stage in stages}
 
-    print(f"[INFO] Running video chat text extractor...")
-    subprocess.run([
-        "python", "video_chat_extractor/main.py",
-        "-input-file", video_path,
-        "-output-folder", chat_output_dir
-    ], check=True)
-    print(f"[DONE] Chat text extraction finished.")
+def topological_order(stages, dependencies):
+    by_name = {stage.name: stage for stage in stages}
+    order, visiting, visited = [], set(), set()
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python run_pipeline.py <path_to_config>")
-        return
-    
-    config_path = sys.argv[1]
-    config, _ = load_config(config_path)
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"[ERROR] Pipeline stages depend on each other in a cycle through '{name}'")
+        visiting.add(name)
+        for dependency in dependencies[name]:
+            visit(dependency)
+        visiting.discard(name)
+        visited.add(name)
+        order.append(by_name[name])
+
+    for stage in stages:
+        visit(stage.name)
+    return order
+
+def run_command(stage, env):
+    # output lines are prefixed with the stage name, stages running side by side stay readable
+    try:
+        process = subprocess.Popen(stage.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+                                   env=env)
+    except OSError as e:
+        print(f"[ERROR] {stage.name} could not be started: {e}")
+        return False
+    for line in process.stdout:
+        print(f"[{stage.name}] {line}", end="")
+    if process.wait() != 0:
+        print(f"[ERROR] {stage.name} failed with code {process.returncode}")
+        return False
+    return True
+
+def call_function(stage):
+    # in this process, sharing its imports and loaded models with the other stages
+    if stage.function() is False:
+        print(f"[ERROR] {stage.name} failed")
+        return False
+    return True
+
+def run_stage(stage, env, on_finish, wait_upstream=None):
+    # wait_upstream: for a stage started on streamed inputs, waits for their stages, True if all of them succeeded
+    ok = False
+    try:
+        if stage.manifest:
+            # the inputs as this run reads them, a failed run leaves no manifest behind
+            previous = stage.load_manifest()
+            fingerprint = stage.fingerprint(previous) if wait_upstream is None else None
+            if os.path.exists(stage.manifest):
+                os.remove(stage.manifest)
+        ok = call_function(stage) if stage.function else run_command(stage, env)
+        if ok and stage.manifest and wait_upstream is not None:
+            # streamed inputs are complete only when their stage is, the manifest records them then
+            if wait_upstream():
+                fingerprint = stage.fingerprint(previous)
+            else:
+                print(f"[INFO] {stage.name}: no manifest, an upstream stage failed after it started")
+        if ok and stage.manifest and fingerprint and all(output_written(path, stage.started_at) for path in stage.outputs):
+            stage.save_manifest(fingerprint)
+    except Exception as e:
+        print(f"[ERROR] {stage.name} failed: {type(e).__name__}: {e}")
+    finally:
+        on_finish(stage, ok)
+
+def run_dag(stages, cpu_budget=None, memory_budget_mb=None, network_slots=2, use_cache=True):
+    """Run the stages as soon as the stages producing their inputs are done, side by side within the CPU/memory budget
+    and at most network_slots network-bound stages at a time.
+
+    A stage's outputs count as ready when it exits successfully and all of them exist, so nothing polls the file system;
+    a stage whose inputs from a running stage are all in its streams starts right away (and is never cached then).
+    Stages downstream of a failed stage are skipped, stages whose manifest still matches are not run again (with
+    use_cache). A rerun stage that writes the same output as before leaves its downstream stages cached. Returns the
+    timing report.
+    """
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    memory_budget_mb = memory_budget_mb or psutil.virtual_memory().available / 2 ** 20 * 0.9
+    dependencies = stage_dependencies(stages)
+    order = topological_order(stages, dependencies)
+    by_name = {stage.name: stage for stage in stages}
+    produced = {output for stage in stages for output in stage.outputs}
+    producers = {output: stage for stage in stages for output in stage.outputs}
+    for stage in stages:
+        missing = [path for path in stage.inputs if path not in produced and not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"[ERROR] {stage.name} needs {', '.join(missing)}, which no stage writes")
+
+    condition = threading.Condition()
+    used = {"cpus": 0, "memory_mb": 0.0, "network": 0}
+    exclusive = set()  # exclusive names of the running stages
+    start_time = time.perf_counter()
+
+    def reserved(stage):
+        # a stage larger than the whole budget still runs, alone
+        if stage.network:
+            return 0, 0.0
+        return min(stage.cpus, cpu_budget), min(stage.memory_mb, memory_budget_mb)
+
+    def streaming(stage):
+        # running stages whose outputs this stage reads, all of them streamed; None if it has to wait for one
+        running = {producers[path] for path in stage.inputs if path in producers and producers[path].status == "running"}
+        if any(path not in producers[path].streams for path in stage.inputs if producers.get(path) in running):
+            return None
+        return running
+
+    def upstream_waiter(upstream):
+        def wait():
+            with condition:
+                condition.wait_for(lambda: all(stage.status != "running" for stage in upstream))
+                return all(stage.status == "done" for stage in upstream)
+        return wait
+
+    def finish(stage, ok):
+        with condition:
+            stage.end = time.perf_counter() - start_time
+            missing = [path for path in stage.outputs if not output_written(path, stage.started_at)]
+            if ok and missing:
+                print(f"[ERROR] {stage.name} finished without writing {', '.join(missing)}")
+            stage.status = "done" if ok and not missing else "failed"
+            cpus, memory_mb = reserved(stage)
+            used["cpus"] -= cpus
+            used["memory_mb"] -= memory_mb
+            used["network"] -= stage.network
+            exclusive.discard(stage.exclusive)
+            print(f"[DONE] {stage.name} {stage.status} after {stage.duration():.1f}s")
+            condition.notify_all()
+
+    with condition:
+        while True:
+            changed = False
+            for stage in order:
+                if stage.status != "pending":
+                    continue
+                states = [by_name[name].status for name in dependencies[stage.name]]
+                if any(state in ("failed", "skipped") for state in states):
+                    stage.status = "skipped"
+                    print(f"[SKIP] {stage.name}: an upstream stage failed")
+                    changed = True
+                    continue
+                if any(state not in ("done", "cached", "running") for state in states):
+                    continue
+                upstream = streaming(stage)
+                if upstream is None:
+                    continue
+                if upstream and not stage.checked:
+                    stage.checked = True  # its inputs are still being written, nothing to compare yet
+                    print(f"[INFO] Starting {stage.name} on the streamed outputs of {', '.join(s.name for s in upstream)}")
+                    stage.discard_state()
+                if stage.manifest and not stage.checked:
+                    stage.checked = True  # once, the stage may wait for resources afterwards
+                    if use_cache:
+                        cached, reason = stage.up_to_date()
+                        if cached:
+                            stage.status = "cached"
+                            print(f"[SKIP] {stage.name}: up to date")
+                            changed = True
+                            continue
+                        print(f"[INFO] Rebuilding {stage.name}: {reason}")
+                    stage.discard_state()
+                cpus, memory_mb = reserved(stage)
+                if stage.network and used["network"] >= network_slots:
+                    continue
+                if stage.exclusive and stage.exclusive in exclusive:
+                    continue
+                if used["cpus"] and (used["cpus"] + cpus > cpu_budget or used["memory_mb"] + memory_mb > memory_budget_mb):
+                    continue
+                used["cpus"] += cpus
+                used["memory_mb"] += memory_mb
+                used["network"] += stage.network
+                if stage.exclusive:
+                    exclusive.add(stage.exclusive)
+                stage.status = "running"
+                stage.start = time.perf_counter() - start_time
+                stage.started_at = time.time()
+                if stage.network:
+                    print(f"[INFO] Starting {stage.name} (network)")
+                else:
+                    print(f"[INFO] Starting {stage.name} ({cpus} CPUs, {memory_mb:.0f} MB reserved)")
+                if stage.streams:
+                    # before any reader starts, so it never mistakes the outputs of an earlier run for this one's
+                    for path in stage.outputs:
+                        if os.path.isfile(path):
+                            os.remove(path)
+                env = dict(os.environ, OMP_NUM_THREADS=str(max(cpus, 1)))
+                threading.Thread(target=run_stage, args=(stage, env, finish, upstream_waiter(upstream) if upstream else None),
+                                 daemon=True).start()
+                changed = True
+            if not any(stage.status in ("pending", "running") for stage in stages):
+                break
+            if not changed:
+                condition.wait()  # woken up by finish()
+
+    wall = time.perf_counter() - start_time
+    return pipeline_report(order, dependencies, wall)
+
+def pipeline_report(order, dependencies, wall):
+    # critical path: the chain of dependent stages with the largest summed duration, the lower bound of the wall time
+    path_end, previous = {}, {}
+    for stage in order:
+        before = max(dependencies[stage.name], key=lambda name: path_end[name], default=None)
+        path_end[stage.name] = stage.duration() + (path_end[before] if before else 0.0)
+        previous[stage.name] = before
+    last = max(path_end, key=path_end.get)
+    path = []
+    while last:
+        path.insert(0, last)
+        last = previous[last]
+    return {
+        "wall_s": round(wall, 2),
+        "serial_s": round(sum(stage.duration() for stage in order), 2),
+        "critical_path": path,
+        "critical_path_s": round(sum(stage.duration() for stage in order if stage.name in path), 2),
+        "stages": {stage.name: {"status": stage.status, "start_s": round(stage.start or 0.0, 2),
+                                "duration_s": round(stage.duration(), 2), "depends_on": dependencies[stage.name]}
+                   for stage in order}
+    }
+
+def match_dir_of(config):
     match_id = config["match_url"].split("/")[-1].split("#")[0]
-    match_dir = os.path.join("data", f"match_{match_id}")
+    return os.path.join("data", f"match_{match_id}")
+
+def pipeline_stages(config, config_path, match_dir, cpus, prefix="", in_process=True):
     video_path = os.path.join(match_dir, "video.mp4")
+    webdata_dir = os.path.join(match_dir, "webdata")
+    champion_teams_path = os.path.join(webdata_dir, "champion_teams.json")
+    chat_output_dir = os.path.join(match_dir, "chat_text")
+    manifest_dir = os.path.join(match_dir, "manifests")
+    playlist_path = os.path.join(match_dir, "segments", "index.m3u8")
+    predict_files = [video_path]
+    if config.get("roster") or config.get("roster_head"):
+        predict_files.append(champion_teams_path)
+    # progressive: the download publishes segments while it runs and predict reads them from the playlist
+    progressive = bool(config.get("progressive"))
+    predict_inputs = [playlist_path] + predict_files[1:] if progressive else predict_files
+    download_outputs = [video_path, playlist_path] if progressive else [video_path]
+    # with chat_region the prediction's decode also writes the chat region, the chat OCR reads that instead of the video
+    chat_video_path = os.path.join(chat_output_dir, "chat_region.mp4") if config.get("chat_region") else video_path
+    predict_outputs = [os.path.join(match_dir, "results.json")]
+    if chat_video_path != video_path:
+        predict_outputs.append(chat_video_path)
+    os.makedirs(chat_output_dir, exist_ok=True)
 
-    # Schritt 1: scrapeWebData
-    run_script("scrapeWebData.py", config_path)
+    # the config is read again when a manifest is checked or written, the scrape stage adds the VOD info to it
+    def vod_params():
+        config, _ = load_config(config_path)
+        return {key: config.get(key) for key in ["match_url"] + VOD_KEYS}
 
-    # Schritt 2: Warte bis das Video da ist
-    wait_for_file(video_path)
+    def predict_params():
+        config, _ = load_config(config_path)
+        settings = {key: value for key, value in config.items() if key not in RUNTIME_KEYS and key not in VOD_KEYS}
+        return {**settings, **script_constants("predict_video.py", PREDICT_CONSTANTS)}
 
-    # Schritt 3: predict_video
-    run_script("predict_video.py", config_path)
+    scrape = download = predict = None
+    if in_process:
+        # imported once for all stages and matches, predict_video keeps the loaded model between runs; its settings
+        # are module globals of this process, so only one in-process prediction runs at a time (exclusive below)
+        import scrapeWebData
+        import predict_video
+        scrape = lambda: scrapeWebData.scrape_match(config_path, download=False)
+        download = lambda: scrapeWebData.download_from_config(scrapeWebData.load_config(config_path))
+        predict = lambda: predict_video.run(config_path) is not None
+
+    model_path = script_constants("predict_video.py", ["MODEL_PATH"]).get("MODEL_PATH", os.path.join("data", "best.pt"))
+    chat_script = os.path.join("video_chat_extractor", "main.py")
+    return [
+        # Schritt 1: Webdaten, speichert die VOD-Infos in der Config
+        Stage(prefix + "scrape", [sys.executable, "scrapeWebData.py", config_path, "--no-download"], inputs=[config_path],
+              outputs=[champion_teams_path], network=True, manifest=os.path.join(manifest_dir, "scrape.json"),
+              params={"match_url": config["match_url"]}, files=["scrapeWebData.py"], function=scrape),
+        # Schritt 2: Video, champion_teams.json steht für die VOD-Infos, die im selben Durchlauf gespeichert werden
+        Stage(prefix + "download", [sys.executable, "scrapeWebData.py", config_path, "--download-only"],
+              inputs=[champion_teams_path], outputs=download_outputs, network=True,
+              manifest=os.path.join(manifest_dir, "download.json"), params=vod_params, files=[], function=download,
+              streams=[playlist_path] if progressive else ()),
+        # Schritt 3 und 4 brauchen nur das Video und laufen parallel, mit chat_region liest 4 den Chat-Ausschnitt aus 3
+        Stage(prefix + "predict", [sys.executable, "predict_video.py", config_path], inputs=predict_inputs,
+              outputs=predict_outputs, cpus=max(cpus * 3 // 4, 1), memory_mb=2000,
+              manifest=os.path.join(manifest_dir, "predict.json"), params=predict_params,
+              files=predict_files + [model_path, os.path.join("..", "pingMap.json")] + PREDICT_MODULES,
+              state=[os.path.join(match_dir, name) for name in ["checkpoint.json", "results.jsonl", "shards"]],
+              function=predict, exclusive="predict_video" if in_process else None),
+        Stage(prefix + "chat", [sys.executable, chat_script, "-input-file", chat_video_path, "-output-folder", chat_output_dir],
+              inputs=[chat_video_path], outputs=[os.path.join(chat_output_dir, "chat_log_*.txt")],
+              cpus=max(cpus // 4, 1), memory_mb=2000,
+              manifest=os.path.join(manifest_dir, "chat.json"), files=[chat_video_path, chat_script]),
+    ]
+
+def expand_config_paths(paths):
+    # config files, directories (all *.json inside) or glob patterns
+    config_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            config_paths += sorted(glob.glob(os.path.join(path, "*.json")))
+        elif glob.has_magic(path):
+            config_paths += sorted(glob.glob(path))
+        else:
+            config_paths.append(path)
+    return config_paths
+
+def print_report(report):
+    print(f"[INFO] Wall time {report['wall_s']:.1f}s, all stages one after another {report['serial_s']:.1f}s")
+    print(f"[INFO] Critical path {' -> '.join(report['critical_path'])}: {report['critical_path_s']:.1f}s")
+    for name, stage in report["stages"].items():
+        print(f"[INFO]   {name:<8} {stage['status']:<8} start {stage['start_s']:7.1f}s  duration {stage['duration_s']:7.1f}s")
+
+def run_batch(config_paths, cpus, memory_mb, network_jobs, summary_path, use_cache=True, in_process=True):
+    # one graph over all matches, so downloads of the next matches overlap with the predictions of the first ones;
+    # matches whose stage manifests all match are not run again
+    stages, matches = [], {}
+    for config_path in config_paths:
+        config, _ = load_config(config_path)
+        match_dir = match_dir_of(config)
+        name = os.path.basename(match_dir)
+        if name in matches:
+            print(f"[SKIP] {config_path}: {name} is already in this batch")
+            continue
+        matches[name] = config_path
+        stages += pipeline_stages(config, config_path, match_dir, cpus, f"{name}/", in_process)
+
+    print(f"[INFO] Batch: {len(matches)} matches")
+    report = run_dag(stages, cpus, memory_mb, network_jobs, use_cache) if stages else {"wall_s": 0.0, "stages": {}}
+    summary = {"wall_s": report["wall_s"], "critical_path": report.get("critical_path", []), "matches": {}}
+    for name, config_path in matches.items():
+        match_stages = {stage: row for stage, row in report["stages"].items() if stage.startswith(f"{name}/")}
+        started = [row for row in match_stages.values() if row["duration_s"]]
+        start = min((row["start_s"] for row in started), default=0.0)
+        end = max((row["start_s"] + row["duration_s"] for row in started), default=0.0)
+        statuses = {row["status"] for row in match_stages.values()}
+        summary["matches"][name] = {
+            "config": config_path,
+            "status": "complete" if statuses == {"cached"} else "done" if statuses <= {"done", "cached"} else "failed",
+            "duration_s": round(end - start, 2),
+            "stages": {stage.split("/", 1)[1]: row["duration_s"] for stage, row in match_stages.items()},
+            "failed": [stage.split("/", 1)[1] for stage, row in match_stages.items() if row["status"] == "failed"],
+            "skipped": [stage.split("/", 1)[1] for stage, row in match_stages.items() if row["status"] == "skipped"],
+            "cached": [stage.split("/", 1)[1] for stage, row in match_stages.items() if row["status"] == "cached"],
+        }
+
+    print(f"[INFO] Batch finished in {summary['wall_s']:.1f}s")
+    for name, row in summary["matches"].items():
+        if row["status"] == "complete":
+            print(f"[INFO]   {name:<24} already complete")
+        elif row["status"] == "done":
+            print(f"[INFO]   {name:<24} done in {row['duration_s']:.1f}s")
+        else:
+            print(f"[ERROR]  {name:<24} failed in {', '.join(row['failed'])} (skipped: {', '.join(row['skipped']) or '-'})")
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"[DONE] Saved {summary_path}")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape, download, predict and extract chat text for one or many matches")
+    parser.add_argument("configs", nargs="+", help="config file(s), a folder with configs or a glob like 'configs/*.json'")
+    parser.add_argument("--cpus", type=int, help="CPU budget for prediction and chat extraction (default: all cores)")
+    parser.add_argument("--memory-mb", type=float, help="memory budget (default: 90%% of the free memory)")
+    parser.add_argument("--network-jobs", type=int, default=2, help="concurrent scrapes/downloads")
+    parser.add_argument("--summary", default=os.path.join("data", "batch_summary.json"))
+    parser.add_argument("--no-cache", action="store_true", help="run every stage, even if its manifest matches")
+    parser.add_argument("--subprocesses", action="store_true",
+                        help="start a new interpreter per stage instead of running scraping and prediction in this process")
+    args = parser.parse_args()
+
+    config_paths = expand_config_paths(args.configs)
+    if len(config_paths) != 1 or os.path.isdir(args.configs[0]) or glob.has_magic(args.configs[0]):
+        os.makedirs(os.path.dirname(args.summary) or ".", exist_ok=True)
+        summary = run_batch(config_paths, args.cpus or os.cpu_count() or 1, args.memory_mb, args.network_jobs, args.summary,
+                            not args.no_cache, not args.subprocesses)
+        if any(row["status"] == "failed" for row in summary["matches"].values()):
+            sys.exit(1)
+        return
+
+    config_path = config_paths[0]
+    config, _ = load_config(config_path)
+    match_dir = match_dir_of(config)
 
-    # Step 4: run chat text extractor
-    run_chat_extraction(video_path, match_dir)
+    cpus = args.cpus or config.get("pipeline_cpus") or os.cpu_count() or 1
+    stages = pipeline_stages(config, config_path, match_dir, cpus, in_process=not args.subprocesses)
+    report = run_dag(stages, cpus, args.memory_mb or config.get("pipeline_memory_mb"), args.network_jobs,
+                     not args.no_cache)
+    print_report(report)
+    with open(os.path.join(match_dir, "pipeline_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
 
+    failed = [name for name, stage in report["stages"].items() if stage["status"] not in ("done", "cached")]
+    if failed:
+        raise RuntimeError(f"[ERROR] Pipeline stages {failed} did not finish")
     print("[PIPELINE DONE] Alles erfolgreich durchgelaufen.")
 
 if __name__ == "__main__":
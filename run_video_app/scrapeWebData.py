@@ -5,10 +5,7 @@ import os
 import subprocess
 import json
 import sys
-
-config_path = sys.argv[1] if len(sys.argv) > 1 else "config.json"
-with open(config_path) as f:
-    config = json.load(f)
+from vod_segments import SegmentWriter, publish_local_video, SEGMENTS_DIR
 
 def extract_item_build_timeline(soup, participant_id):
     participant_items = []
@@ -103,6 +100,29 @@ def download_vod_clip(vod_id, start_ms, duration, output_path="video_clip.mp4",
     subprocess.run(command, check=True)
     print(f"VOD clip saved as: {output_path}")
 
+def download_vod_segments(vod_id, start_ms, duration, segments_dir, output_path, chunk_seconds=60, buffer_ms=60000):
+    # progressive download: chunk by chunk, each one is appended to the segment playlist as soon as it is there
+    start_s = start_ms // 1000
+    end_s = -(-(start_ms + duration + buffer_ms) // 1000)
+    writer = SegmentWriter(segments_dir, chunk_seconds)
+    chunk_path = os.path.join(segments_dir, "download.tmp.mp4")
+    for chunk_start in range(start_s, end_s, chunk_seconds):
+        chunk_end = min(chunk_start + chunk_seconds, end_s)
+        command = [
+            "TwitchDownloaderCLI.exe",
+            "videodownload",
+            "--id", vod_id,
+            "-b", convert_milliseconds_to_hms(chunk_start * 1000),
+            "-e", convert_milliseconds_to_hms(chunk_end * 1000),
+            "-o", chunk_path
+        ]
+        print("Running TwitchDownloaderCLI command:", " ".join(command))
+        subprocess.run(command, check=True)
+        writer.add_chunk(chunk_path, chunk_start - start_s, chunk_end - chunk_start)
+        os.remove(chunk_path)
+    writer.close(output_path)
+    print(f"VOD clip saved as: {output_path} ({len(writer.segments)} segments)")
+
 def extract_champion_teams(soup):
     champions = []
     tab_imgs = soup.select(".matchPlayersTabs .tab img")
@@ -115,7 +135,48 @@ def extract_champion_teams(soup):
     
     return champions
 
-def main():
+def load_config(config_path):
+    with open(config_path) as f:
+        return json.load(f)
+
+def download_from_config(config):
+    # download with the VOD info that a --no-download run saved in the config; with "progressive" as segments that
+    # predict_video.py reads while the download runs, "local_vod" replaces Twitch by a local file for tests
+    match_id = config["match_url"].split("/")[-1].split("#")[0]
+    match_dir = os.path.join("data", f"match_{match_id}")
+    video_path = os.path.join(match_dir, "video.mp4")
+    if config.get("local_vod"):
+        publish_local_video(config["local_vod"], os.path.join(match_dir, SEGMENTS_DIR), video_path,
+                            config.get("segment_seconds", 60), config.get("local_vod_rate", 4.0))
+        return True
+    if "vod_id" not in config:
+        print("No Twitch VOD info in config, run scrapeWebData.py without --download-only first.")
+        return False
+    if config.get("progressive"):
+        download_vod_segments(
+            vod_id = config["vod_id"],
+            start_ms = config["vod_timestamp"],
+            duration = config.get("game_duration_ms", 1800),
+            segments_dir = os.path.join(match_dir, SEGMENTS_DIR),
+            output_path = video_path,
+            chunk_seconds = config.get("segment_seconds", 60)
+        )
+        return True
+    download_vod_clip(
+        vod_id = config["vod_id"],
+        start_ms = config["vod_timestamp"],
+        duration = config.get("game_duration_ms", 1800),
+        output_path = video_path
+    )
+    return True
+
+def scrape_match(config_path, config=None, download=True):
+    """Scrape the match page into webdata/, save the VOD info in the config and (with download) download the VOD.
+
+    Returns False if the page or the VOD info could not be loaded.
+    """
+    if config is None:
+        config = load_config(config_path)
     url = config["match_url"]
     participant_id = url.split("#")[-1]
 
@@ -134,9 +195,6 @@ def main():
         webdata_dir = os.path.join(match_dir, "webdata")
         os.makedirs(webdata_dir, exist_ok=True)
 
-        # Video path
-        video_path = os.path.join(match_dir, "video.mp4")
-
         item_df = extract_item_build_timeline(soup, participant_id)
         gold_df = extract_gold_difference_timeline(soup)
         runes_df = extract_runes_from_table(soup, participant_id)
@@ -160,20 +218,29 @@ def main():
             # Save VOD ID to config.json
             config["vod_id"] = vod_info["vod_id"]
             config["vod_timestamp"] = vod_info["timestamp"]
+            config["game_duration_ms"] = game_duration
             with open(config_path, "w") as f:
                 json.dump(config, f, indent=4)
 
             #Download VOD
-            download_vod_clip(
-                vod_id = vod_info["vod_id"],
-                start_ms = (vod_info["timestamp"]),
-                duration = game_duration,
-                output_path = video_path
-            )
+            if not download:
+                return True
+            return download_from_config(config)
         else:
             print("No Twitch VOD info found in page.")
     else:
         print(f"Failed to load page: {response.status_code}")
+    return False
+
+def main():
+    # the batch mode of run_pipeline.py runs scraping (--no-download) and downloading (--download-only) as separate steps
+    config_path = sys.argv[1] if len(sys.argv) > 1 else "config.json"
+    if "--download-only" in sys.argv:
+        ok = download_from_config(load_config(config_path))
+    else:
+        ok = scrape_match(config_path, download="--no-download" not in sys.argv)
+    if not ok:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,150 @@
+import sys
+import json
+import functools
+import time
+import threading
+import numpy as np
+
+class _NoTiming:
+    # shared do-nothing context, so disabled timing costs one attribute lookup and call per stage
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_TIMING = _NoTiming()
+
+class _Timing:
+    def __init__(self, timer, stage, count):
+        self.timer = timer
+        self.stage = stage
+        self.count = count
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.stage, time.perf_counter() - self.start, self.count)
+        return False
+
+class StageTimer:
+    """Wall time and item counts per pipeline stage, p50/p95/p99 per call, optional live progress line.
+
+    Stages can run on several threads at once (pipeline mode), their times then add up to more than the wall time.
+    """
+
+    def __init__(self, enabled=False, progress=False, progress_interval=1.0):
+        self.progress_interval = progress_interval
+        self.lock = threading.Lock()
+        self.reset(enabled, progress)
+
+    def reset(self, enabled=False, progress=False):
+        # a fresh measurement, e.g. for the next match predicted in the same process
+        self.enabled = enabled
+        self.progress_enabled = enabled and progress
+        self.calls = {}  # stage -> list of call durations in s
+        self.counts = {}  # stage -> processed items
+        self.start = time.perf_counter()
+        self.last_progress = 0.0
+
+    def stage(self, name, count=1):
+        if not self.enabled:
+            return _NO_TIMING
+        return _Timing(self, name, count)
+
+    def timed(self, name):
+        # decorator, checks enabled per call since the timer can be reset after the functions are defined
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def add(self, name, seconds, count=1):
+        with self.lock:
+            self.calls.setdefault(name, []).append(seconds)
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def iterate(self, name, items):
+        # times every next() of items, e.g. how long the decoder takes to deliver each frame
+        if not self.enabled:
+            return items
+        return self._timed_items(name, items)
+
+    def _timed_items(self, name, items):
+        iterator = iter(items)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                self.add(name, time.perf_counter() - start)
+                yield item
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    def progress(self, frames, filename):
+        if not self.progress_enabled:
+            return
+        now = time.perf_counter()
+        if now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        elapsed = now - self.start
+        with self.lock:
+            slowest = max(self.calls, key=lambda name: sum(self.calls[name]), default=None)
+        busiest = f", most time in {slowest}" if slowest else ""
+        sys.stderr.write(f"\r[PROGRESS] {frames} frames ({filename}), {frames / elapsed:.2f} frames/s{busiest}   ")
+        sys.stderr.flush()
+
+    def summary(self, frames):
+        elapsed = time.perf_counter() - self.start
+        with self.lock:
+            calls = {name: np.array(durations) for name, durations in self.calls.items()}
+            counts = dict(self.counts)
+        stages = {}
+        for name, durations in calls.items():
+            total = float(durations.sum())
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99]) * 1000
+            stages[name] = {
+                "total_s": round(total, 4),
+                "share_of_wall": round(total / elapsed, 4) if elapsed else 0.0,
+                "calls": len(durations),
+                "items": counts[name],
+                "items_per_s": round(counts[name] / total, 2) if total else None,
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3)
+            }
+        return {
+            "wall_s": round(elapsed, 4),
+            "frames": frames,
+            "frames_per_s": round(frames / elapsed, 3) if elapsed else None,
+            "stages": stages
+        }
+
+    def report(self, frames, path=None):
+        if not self.enabled:
+            return None
+        if self.progress_enabled:
+            sys.stderr.write("\n")
+        summary = self.summary(frames)
+        print(f"[TIMING] {frames} frames in {summary['wall_s']:.1f}s ({summary['frames_per_s']} frames/s)")
+        for name, stage in sorted(summary["stages"].items(), key=lambda entry: -entry[1]["total_s"]):
+            print(f"[TIMING] {name:<16} {stage['total_s']:8.2f}s {stage['share_of_wall']:6.1%}  {stage['items']:6d} items  "
+                  f"p50 {stage['p50_ms']:.2f} ms  p95 {stage['p95_ms']:.2f} ms  p99 {stage['p99_ms']:.2f} ms")
+        if path:
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=2)
+            print(f"[TIMING] Saved {path}")
+        return summary
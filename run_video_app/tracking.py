@@ -0,0 +1,97 @@
+import cv2
+import numpy as np
+
+# ids are derived from the frame a track starts in, so they stay unique across shards and resumed runs
+MAX_TRACKS_PER_FRAME = 1000
+
+class Track:
+    def __init__(self, track_id, prediction, gray):
+        self.id = track_id
+        self.name = prediction[4]
+        self.velocity = np.zeros(2)
+        self.set_detection(prediction, gray)
+
+    def set_detection(self, prediction, gray):
+        x1, y1, x2, y2 = prediction[:4]
+        self.box = np.array([x1, y1, x2, y2], dtype=float)
+        self.detected_center = self.center()
+        self.frames_since_detection = 0
+        self.confidence = prediction[5]
+        self.score = 1.0
+        self.misses = 0
+        template = gray[max(y1, 0):y2, max(x1, 0):x2]
+        # icons cut off at the minimap border are too small to match, those tracks wait for the next detection
+        self.template = template if min(template.shape[:2], default=0) >= 4 else None
+
+    def center(self):
+        return (self.box[:2] + self.box[2:]) / 2
+
+class MinimapTracker:
+    """Tracks champions and pings between detector runs.
+
+    update() takes the detector output of a frame and assigns track ids, predict() moves every track by its
+    velocity and refines the position with template matching on the grayscale minimap. The lowest match score
+    of predict() tells the caller when the tracks are no longer reliable and the detector has to run again.
+    """
+
+    def __init__(self, match_distance=20, search_margin=10, max_misses=1):
+        self.match_distance = match_distance
+        self.search_margin = search_margin
+        self.max_misses = max_misses
+        self.tracks = []
+
+    def update(self, frame_index, predictions, gray):
+        # greedy matching of same-class boxes by center distance, returns the track id of every prediction
+        unmatched = list(self.tracks)
+        track_ids = []
+        for n, prediction in enumerate(predictions):
+            center = np.array([(prediction[0] + prediction[2]) / 2, (prediction[1] + prediction[3]) / 2])
+            candidates = [t for t in unmatched if t.name == prediction[4]]
+            distances = [np.linalg.norm(t.center() - center) for t in candidates]
+            if candidates and min(distances) <= self.match_distance:
+                track = candidates[int(np.argmin(distances))]
+                unmatched.remove(track)
+                track.velocity = (center - track.detected_center) / (track.frames_since_detection + 1)
+                track.set_detection(prediction, gray)
+            else:
+                track = Track(frame_index * MAX_TRACKS_PER_FRAME + n, prediction, gray)
+                self.tracks.append(track)
+            track_ids.append(track.id)
+
+        for track in unmatched:
+            track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+        return track_ids
+
+    def predict(self, gray):
+        # returns (predictions, track ids, lowest match score) for a frame the detector skipped
+        predictions = []
+        track_ids = []
+        lowest_score = 1.0
+        height, width = gray.shape[:2]
+        for track in self.tracks:
+            if track.misses:
+                continue  # not confirmed by the last detection
+            track.frames_since_detection += 1
+            box = track.box + np.tile(track.velocity, 2)
+            if track.template is not None:
+                template_h, template_w = track.template.shape[:2]
+                x = int(round(box[0])) - self.search_margin
+                y = int(round(box[1])) - self.search_margin
+                x0, y0 = max(x, 0), max(y, 0)
+                x1 = min(x + template_w + 2 * self.search_margin, width)
+                y1 = min(y + template_h + 2 * self.search_margin, height)
+                if x1 - x0 >= template_w and y1 - y0 >= template_h:
+                    scores = cv2.matchTemplate(gray[y0:y1, x0:x1], track.template, cv2.TM_CCOEFF_NORMED)
+                    _, track.score, _, (best_x, best_y) = cv2.minMaxLoc(scores)
+                    moved = np.array([x0 + best_x, y0 + best_y], dtype=float) - track.box[:2]
+                    track.velocity = 0.5 * track.velocity + 0.5 * moved  # smoothed, one frame per predict()
+                    box = track.box + np.tile(moved, 2)
+                else:
+                    track.score = 0.0
+            track.box = box
+            lowest_score = min(lowest_score, track.score)
+            x1, y1, x2, y2 = (int(round(v)) for v in box)
+            predictions.append([x1, y1, x2, y2, track.name, round(max(track.confidence * track.score, 0.0), 2)])
+            track_ids.append(track.id)
+        return predictions, track_ids, lowest_score
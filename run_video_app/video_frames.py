@@ -0,0 +1,153 @@
+import os
+import json
+import subprocess
+import cv2
+import numpy as np
+from vod_segments import SegmentFeeder, playlist_head
+
+def frame_name(index):
+    # Same naming as the old ffmpeg PNG dump (frame_0001.png, ...), so results.json keys stay compatible
+    return f"frame_{index + 1:04d}.png"
+
+def is_playlist(video_path):
+    # the segment playlist of a progressive download (vod_segments.py), read while it is still growing
+    return video_path.endswith(".m3u8")
+
+def probe_video(video_path):
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height:format=duration",
+        "-of", "json",
+    ]
+    if is_playlist(video_path):
+        # frame size from the first segment, the duration is only that of the segments so far
+        result = subprocess.run(cmd + ["pipe:0"], input=playlist_head(video_path), capture_output=True, check=True)
+    else:
+        result = subprocess.run(cmd + [video_path], capture_output=True, text=True, check=True)
+    info = json.loads(result.stdout)
+    stream = info["streams"][0]
+    duration = float(info.get("format", {}).get("duration", 0) or 0)
+    return int(stream["width"]), int(stream["height"]), duration
+
+def stream_frames(video_path, fps, frame_step=1, start_index=0, end_index=None, crop=None, size=None, threads=None,
+                  segment_timeout=300):
+    """Decode the video with ffmpeg and yield (index, filename, frame) with raw BGR frames as numpy arrays.
+
+    Only every frame_step-th frame of the fps sampling is decoded, the index still counts in fps steps.
+    start_index seeks to that sample first, decoding stops before end_index, crop=(x, y, w, h) and size=(w, h) let ffmpeg cut out and
+    resize a region, so only that region is piped out of the decoder. threads sets ffmpeg's decoder threads.
+    A segment playlist is fed to ffmpeg segment by segment as the download adds them, until it is ended; decoding fails
+    when no new segment came for segment_timeout s.
+    """
+    filters = [f"fps={fps}/{frame_step}"]
+    if crop is not None:
+        x, y, width, height = crop
+        # convert before cropping, so the crop is pixel exact and matches slicing a full BGR frame
+        filters += ["format=bgr24", f"crop={width}:{height}:{x}:{y}"]
+    else:
+        width, height, _ = probe_video(video_path)
+    if size is not None:
+        width, height = size
+        filters.append(f"scale={width}:{height}:flags=area")
+    frame_size = width * height * 3
+
+    playlist = is_playlist(video_path)
+    cmd = ["ffmpeg", "-v", "error"]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    if start_index and not playlist:
+        cmd += ["-ss", f"{start_index / fps:.3f}"]
+    cmd += ["-f", "mp4", "-i", "pipe:0"] if playlist else ["-i", video_path]
+    if start_index and playlist:
+        cmd += ["-ss", f"{start_index / fps:.3f}"]  # a pipe cannot seek, the frames before are decoded and dropped
+    cmd += [
+        "-vf", ",".join(filters),
+        "-f", "rawvideo", "-pix_fmt", "bgr24",
+        "-"
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE if playlist else None)
+    feeder = None
+    if playlist:
+        feeder = SegmentFeeder(video_path, process.stdin, segment_timeout)
+        feeder.start()
+    try:
+        index = start_index
+        while True:
+            buffer = process.stdout.read(frame_size)
+            if len(buffer) < frame_size or (end_index is not None and index >= end_index):
+                break
+            frame = np.frombuffer(buffer, dtype=np.uint8).reshape((height, width, 3))
+            yield index, frame_name(index), frame
+            index += frame_step
+        if feeder is not None and feeder.error:
+            raise RuntimeError(f"[ERROR] Progressive download stalled: {feeder.error}")
+    finally:
+        if feeder is not None:
+            feeder.stop()
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+
+def read_frame(video_path, fps, index):
+    # a single sample via seek, same index -> frame mapping as stream_frames(), None past the end of the video
+    frames = stream_frames(video_path, fps, start_index=index)
+    try:
+        return next(frames, (None, None, None))[2]
+    finally:
+        frames.close()
+
+class VideoWriter:
+    """Encodes raw BGR frames of one size, written one by one, with ffmpeg into a video file.
+
+    Matroska, written frame by frame without encoder lookahead, so the file of a killed run can still be read up to
+    about its last frame; no B-frames, so joined parts can be cut at any frame without re-encoding.
+    """
+
+    def __init__(self, path, fps, size, crf=18):
+        width, height = size
+        self.process = subprocess.Popen([
+            "ffmpeg", "-v", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "pipe:0",
+            "-c:v", "libx264", "-preset", "veryfast", "-tune", "zerolatency", "-crf", str(crf), "-bf", "0",
+            "-pix_fmt", "yuv444p", "-flush_packets", "1", "-f", "matroska", path
+        ], stdin=subprocess.PIPE)
+        self.frames = 0
+
+    def write(self, frame):
+        self.process.stdin.write(np.ascontiguousarray(frame).tobytes())
+        self.frames += 1
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"[ERROR] ffmpeg could not encode {self.process.args[-1]}")
+
+def join_videos(parts, output_path):
+    # parts: (path, seconds to keep or None for all) in playback order, joined without re-encoding
+    list_path = output_path + ".txt"
+    with open(list_path, "w") as f:
+        for path, duration in parts:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+            if duration is not None:
+                f.write(f"outpoint {duration:.3f}\n")
+    try:
+        subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy",
+                        output_path], check=True)
+    finally:
+        os.remove(list_path)
+
+def extract_frames(video_path, output_folder, fps):
+    # Debug mode only: dumps every sampled frame as PNG
+    cmd = [
+        "ffmpeg", "-i", video_path,
+        "-vf", f"fps={fps}",
+        os.path.join(output_folder, "frame_%04d.png")
+    ]
+    subprocess.run(cmd)
+
+def read_frame_files(frames_dir):
+    frame_files = sorted([f for f in os.listdir(frames_dir) if f.endswith(".png")])
+    for i, filename in enumerate(frame_files):
+        yield i, filename, cv2.imread(os.path.join(frames_dir, filename))
@@ -6,6 +6,7 @@ from PIL import Image
 import os
 import base64
 import re
+from results_store import load_results
 
 st.set_page_config(page_title="Prediction Viewer", layout="wide")
 # ---- CONFIG: Match Selection ---- #
@@ -19,7 +20,6 @@ available_matches = sorted([d for d in os.listdir(MATCHES_DIR) if d.startswith("
 selected_match = st.selectbox("Select a match", available_matches)
 DATA_DIR = os.path.join(MATCHES_DIR, selected_match)
 # ---- Paths ---- #
-RESULTS_PATH = os.path.join(DATA_DIR, "results.json")
 WEBDATA_DIR = os.path.join(DATA_DIR, "webdata")
 ITEM_CSV = os.path.join(WEBDATA_DIR, "player_item_build.csv")
 GOLD_CSV = os.path.join(WEBDATA_DIR, "gold_difference_timeline.csv")
@@ -42,8 +42,7 @@ m = (timestamp % 3600) // 60
 s = timestamp % 60
 
 # ---- Load Data ---- #
-with open(RESULTS_PATH, "r") as f:
-    results = json.load(f)
+results = load_results(DATA_DIR)  # results.npz (memory-mapped) if present, else results.json
 
 gold_graph = pd.read_csv(GOLD_CSV)
 frame_files = sorted(results.keys())
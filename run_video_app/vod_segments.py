@@ -0,0 +1,247 @@
+import os
+import time
+import shutil
+import struct
+import tempfile
+import threading
+import subprocess
+
+# Progressive download: the VOD is written as fragmented MP4 segments listed in an HLS playlist (segments/index.m3u8)
+# while it downloads, and predict_video.py decodes the segments that are already there. Every downloaded chunk is
+# remuxed into fragments, the decode times of its fragments are shifted to the chunk's start in the VOD, so init.mp4
+# followed by all segments is one continuous fragmented MP4 that ffmpeg reads from a pipe.
+
+SEGMENTS_DIR = "segments"
+PLAYLIST_NAME = "index.m3u8"
+INIT_NAME = "init.mp4"
+
+def mp4_boxes(data, start=0, end=None):
+    # top-level (or child, within start:end) boxes as (type, start, end)
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[position:position + 8])
+        if size == 1:
+            size = struct.unpack(">Q", data[position + 8:position + 16])[0]
+        elif size == 0:
+            size = end - position
+        yield kind, position, position + size
+        position += size
+
+def child_box(data, box, kind, header=8):
+    return next(((k, s, e) for k, s, e in mp4_boxes(data, box[1] + header, box[2]) if k == kind), None)
+
+def track_timescales(data):
+    # track_ID -> timescale of its media (moov/trak/tkhd and moov/trak/mdia/mdhd)
+    moov = next(box for box in mp4_boxes(data) if box[0] == b"moov")
+    timescales = {}
+    for trak in (box for box in mp4_boxes(data, moov[1] + 8, moov[2]) if box[0] == b"trak"):
+        _, tkhd, _ = child_box(data, trak, b"tkhd")
+        track_id = struct.unpack(">I", data[tkhd + (28 if data[tkhd + 8] else 20):][:4])[0]
+        _, mdhd, _ = child_box(data, child_box(data, trak, b"mdia"), b"mdhd")
+        timescales[track_id] = struct.unpack(">I", data[mdhd + (28 if data[mdhd + 8] else 20):][:4])[0]
+    return timescales
+
+def fragment_times(data, traf):
+    # (track_ID, position of the decode time in tfdt, its struct format, composition offset of the first sample)
+    _, tfhd, _ = child_box(data, traf, b"tfhd")
+    track_id = struct.unpack(">I", data[tfhd + 12:tfhd + 16])[0]
+    _, tfdt, _ = child_box(data, traf, b"tfdt")
+    composition_offset = 0
+    trun = child_box(data, traf, b"trun")
+    if trun is not None:
+        version, flags = data[trun[1] + 8], int.from_bytes(data[trun[1] + 9:trun[1] + 12], "big")
+        if flags & 0x800 and struct.unpack(">I", data[trun[1] + 12:trun[1] + 16])[0]:
+            # first sample: optional data offset and first sample flags, then duration, size and flags if present
+            position = trun[1] + 16 + 4 * sum(1 for bit in (0x1, 0x4, 0x100, 0x200, 0x400) if flags & bit)
+            composition_offset = struct.unpack(">i" if version else ">I", data[position:position + 4])[0]
+    return track_id, tfdt + 12, ">Q" if data[tfdt + 8] else ">I", composition_offset
+
+def first_presentation(data):
+    # track_ID -> presentation time of the first sample (decode time + composition offset), B-frames delay it
+    moof = next((box for box in mp4_boxes(data) if box[0] == b"moof"), None)
+    starts = {}
+    for traf in (box for box in mp4_boxes(data, moof[1] + 8, moof[2]) if box[0] == b"traf") if moof else []:
+        track_id, position, fmt, composition_offset = fragment_times(data, traf)
+        starts[track_id] = struct.unpack(fmt, data[position:position + struct.calcsize(fmt)])[0] + composition_offset
+    return starts
+
+def shift_fragments(data, shifts):
+    # adds shifts[track_ID] (in the track's timescale) to the baseMediaDecodeTime (moof/traf/tfdt) of every fragment, in place
+    for moof in (box for box in mp4_boxes(data) if box[0] == b"moof"):
+        for traf in (box for box in mp4_boxes(data, moof[1] + 8, moof[2]) if box[0] == b"traf"):
+            track_id, position, fmt, _ = fragment_times(data, traf)
+            value = struct.unpack(fmt, data[position:position + struct.calcsize(fmt)])[0] + shifts[track_id]
+            struct.pack_into(fmt, data, position, value)
+
+class SegmentWriter:
+    """Appends downloaded chunks (ordinary MP4 files, timestamps from 0) to the segment playlist of a match."""
+
+    def __init__(self, segments_dir, target_duration):
+        self.segments_dir = segments_dir
+        self.target_duration = target_duration
+        self.segments = []  # (file name, duration in s)
+        self.timescales = None
+        self.delay = None  # s, the largest B-frame delay of the first chunk's tracks, every chunk starts that late
+        if os.path.isdir(segments_dir):
+            shutil.rmtree(segments_dir)  # a new download, never mix with the fragments of an earlier one
+        os.makedirs(segments_dir)
+
+    def add_chunk(self, chunk_path, offset, duration):
+        # offset: time of the chunk's first frame in the VOD in s, its fragments are shifted so that frame plays then
+        fragmented = os.path.join(self.segments_dir, "chunk.tmp.mp4")
+        subprocess.run(["ffmpeg", "-v", "error", "-y", "-i", chunk_path, "-map", "0", "-c", "copy", "-f", "mp4",
+                        "-movflags", "frag_keyframe+empty_moov+default_base_moof", fragmented], check=True)
+        with open(fragmented, "rb") as f:
+            data = bytearray(f.read())
+        os.remove(fragmented)
+
+        boxes = list(mp4_boxes(data))
+        timescales = track_timescales(data)
+        if self.timescales is None:
+            self.timescales = timescales
+            write_atomic(os.path.join(self.segments_dir, INIT_NAME),
+                         b"".join(data[s:e] for kind, s, e in boxes if kind in (b"ftyp", b"moov")))
+        elif timescales != self.timescales:
+            raise ValueError(f"[ERROR] {chunk_path} has other tracks than the first chunk, cannot append it")
+        # the first sample of every track plays at offset + delay: fragments have no edit list, so a chunk's B-frame
+        # delay (composition offset of its first frame) would otherwise move its video against the audio and the
+        # other chunks. ffmpeg starts the joined stream at the first chunk's start, the delay does not show.
+        start = first_presentation(data)
+        if self.delay is None:
+            self.delay = max((start.get(track_id, 0) / timescale for track_id, timescale in timescales.items()), default=0)
+        shift_fragments(data, {track_id: round((offset + self.delay) * timescale) - start.get(track_id, 0)
+                               for track_id, timescale in self.timescales.items()})
+        name = f"segment_{len(self.segments):04d}.m4s"
+        write_atomic(os.path.join(self.segments_dir, name),
+                     b"".join(data[s:e] for kind, s, e in boxes if kind not in (b"ftyp", b"moov", b"mfra")))
+        self.segments.append((name, duration))
+        self.write_playlist()
+
+    def write_playlist(self, ended=False):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:7", f"#EXT-X-TARGETDURATION:{int(self.target_duration + 1)}",
+                 "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:EVENT", f'#EXT-X-MAP:URI="{INIT_NAME}"']
+        for name, duration in self.segments:
+            lines += [f"#EXTINF:{duration:.3f},", name]
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        write_atomic(os.path.join(self.segments_dir, PLAYLIST_NAME), ("\n".join(lines) + "\n").encode())
+
+    def close(self, video_path):
+        # the complete video.mp4 for the steps that need a seekable file, written before the playlist is ended so a
+        # reader that saw the end can rely on it
+        command = ["ffmpeg", "-v", "error", "-y", "-f", "mp4", "-i", "pipe:0", "-map", "0", "-c", "copy",
+                   "-movflags", "+faststart", video_path + ".part.mp4"]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        for name in [INIT_NAME] + [name for name, _ in self.segments]:
+            with open(os.path.join(self.segments_dir, name), "rb") as f:
+                shutil.copyfileobj(f, process.stdin)
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"[ERROR] Could not join the segments in {self.segments_dir} into {video_path}")
+        os.replace(video_path + ".part.mp4", video_path)
+        self.write_playlist(ended=True)
+
+def write_atomic(path, data):
+    # readers poll the directory, they must never see half a file
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+def read_playlist(playlist_path):
+    # (segment file names, ended)
+    try:
+        with open(playlist_path) as f:
+            lines = [line.strip() for line in f]
+    except FileNotFoundError:
+        return [], False
+    return [line for line in lines if line and not line.startswith("#")], "#EXT-X-ENDLIST" in lines
+
+def playlist_head(playlist_path):
+    # init segment and first segment, enough for ffprobe to read the stream parameters
+    segments_dir = os.path.dirname(playlist_path)
+    names, _ = read_playlist(playlist_path)
+    head = b""
+    for name in [INIT_NAME] + names[:1]:
+        with open(os.path.join(segments_dir, name), "rb") as f:
+            head += f.read()
+    return head
+
+def wait_for_playlist(playlist_path, timeout=300, poll_interval=0.5):
+    # True as soon as the playlist lists a segment, False after timeout s without one
+    deadline = time.perf_counter() + timeout
+    while not read_playlist(playlist_path)[0]:
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(poll_interval)
+    return True
+
+class SegmentFeeder(threading.Thread):
+    """Writes init.mp4 and every segment the playlist lists, as soon as it is listed, into a stream (ffmpeg's stdin).
+
+    Stops after the last segment of an ended playlist, or with error set when no new segment came for timeout s.
+    """
+
+    def __init__(self, playlist_path, stream, timeout=300, poll_interval=0.5):
+        super().__init__(daemon=True)
+        self.playlist_path = playlist_path
+        self.stream = stream
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.error = None
+
+    def run(self):
+        segments_dir = os.path.dirname(self.playlist_path)
+        sent, last_new = 0, time.perf_counter()
+        try:
+            with open(os.path.join(segments_dir, INIT_NAME), "rb") as f:
+                shutil.copyfileobj(f, self.stream)
+            while not self.stopped.is_set():
+                names, ended = read_playlist(self.playlist_path)
+                for name in names[sent:]:
+                    with open(os.path.join(segments_dir, name), "rb") as f:
+                        shutil.copyfileobj(f, self.stream)
+                    self.stream.flush()
+                    sent, last_new = sent + 1, time.perf_counter()
+                if ended and sent == len(names):
+                    break
+                if time.perf_counter() - last_new > self.timeout:
+                    self.error = f"no new segment in {self.playlist_path} for {self.timeout}s"
+                    break
+                self.stopped.wait(self.poll_interval)
+        except (BrokenPipeError, ValueError):
+            pass  # the decoder was closed early, e.g. at the match end
+        finally:
+            try:
+                self.stream.close()
+            except OSError:
+                pass
+
+    def stop(self):
+        self.stopped.set()
+
+def publish_local_video(source_path, segments_dir, video_path, chunk_seconds=60, rate=4.0):
+    """Stand-in for the Twitch download in tests: cuts a local video at keyframes into chunks of about chunk_seconds and
+    appends them to the segment playlist no faster than rate times real time, then writes video_path."""
+    with tempfile.TemporaryDirectory() as chunk_dir:
+        chunk_list = os.path.join(chunk_dir, "chunks.csv")
+        # without avoid_negative_ts the muxer moves B-frame videos by their decode delay, the chunk list would give the
+        # keyframe times that much too late
+        subprocess.run(["ffmpeg", "-v", "error", "-i", source_path, "-map", "0", "-c", "copy", "-avoid_negative_ts",
+                        "disabled", "-f", "segment",
+                        "-segment_time", str(chunk_seconds), "-segment_format", "mp4", "-reset_timestamps", "1",
+                        "-segment_list", chunk_list, "-segment_list_type", "csv",
+                        os.path.join(chunk_dir, "chunk_%04d.mp4")], check=True)
+        with open(chunk_list) as f:
+            chunks = [line.strip().split(",") for line in f if line.strip()]
+
+        writer = SegmentWriter(segments_dir, max(float(end) - float(start) for _, start, end in chunks))
+        start_time = time.perf_counter()
+        for name, start, end in chunks:
+            # the chunk is "downloaded" once the wall time reached its end at the given rate
+            time.sleep(max(float(end) / rate - (time.perf_counter() - start_time), 0))
+            writer.add_chunk(os.path.join(chunk_dir, name), float(start), float(end) - float(start))
+            print(f"[INFO] Segment {len(writer.segments)}: {float(start):.1f}s to {float(end):.1f}s")
+        writer.close(video_path)
+    print(f"[DONE] {len(writer.segments)} segments, video saved as {video_path}")